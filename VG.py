@@ -2,27 +2,8 @@
 # -*- coding: utf-8 -*-
 
 from global_vars import *
-import os, sys, numpy as ny
-import mlp, rbf, dtree, game
-
-
-# Explanation for the trainings data:
-# Every line contains equal amounts of x and o stones.
-# The win/loss/draw indicates the outcome for the next
-# player, if both follow a perfect plan.
-
-
-def my_converter( x ):
-	""" Converter for Numpys loadtxt function.
-	Replace the strings with float values.
-	"""
-
-	if x == 'x': return STONE_HUMAN
-	elif x == 'o': return STONE_AI
-	elif x == 'b': return STONE_BLANK
-	elif x == "win": return WIN
-	elif x == "loss": return LOSS
-	elif x == "draw": return DRAW
+import os, sys, time, numpy as ny
+import mlp, rbf, dtree, game, dataset, store, sweep, crossval
 
 
 def normalize( data ):
@@ -43,34 +24,23 @@ def normalize( data ):
 
 
 def import_traindata( file_in ):
-	""" Import the file with training data for the AI. """
+	""" Import the file with training data for the AI.
+
+	Returns the training data as dataset.Dataset.
+	"""
 
 	sys.stdout.write( "Importing training data ..." )
 	sys.stdout.flush()
 
-	# Assign converters for each attribute.
-	# A dict where the key is the index for each attribute.
-	# The value for each key is the same function to replace the string with a float.
-	convs = dict( zip( range( DATA_NUM_ATTR + 1 ) , [my_converter] * DATA_NUM_ATTR ) )
-	connectfour = ny.loadtxt( file_in, delimiter = ',', converters = convs )
-
-	cf_original = []
-	f = open( file_in, "r" )
-	for line in f:
-		row = line.split( ',' )
-		row[len( row ) - 1] = row[len( row ) - 1].replace( '\n', '' )
-		cf_original.append( row )
-
-	# Split in data and targets
-	data = connectfour[:,:DATA_NUM_ATTR - 1]
-	targets = connectfour[:,DATA_NUM_ATTR - 1:DATA_NUM_ATTR]
+	# Only the limited part of the memory-mapped data is read
+	data = dataset.load( file_in ).take( slice( 0, DATA_LIMIT ) )
 
 	if DATA_NORMALIZE:
-		data = normalize( data )
+		normalize( data.floats() )
 
 	sys.stdout.write( " Done.\n\n" )
 
-	return data, targets, cf_original
+	return data
 
 
 def print_bold( text ):
@@ -89,49 +59,45 @@ def print_help():
 	print
 	print_bold( "    Handling the AI" )
 	print "    select *  - Select the AI type to use: MLP, RBF, DTree"
-	print "    train     - Train the previously selected AI."
+	print "    train     - Train a new AI of the selected type from scratch, or import it from the model store."
+	print "    resume    - Continue training the MLP from the last checkpoint."
+	print "    stream    - Train the MLP with the data file read chunk by chunk."
 	print "    play      - Play Connect Four."
 	print "    export    - Export brain of AI."
 	print "    export_js - Export brain of AI as Javascript."
 	print "    import    - Import brain of AI."
+	print "    convert   - Convert exports in the text format into missing binary exports."
+	print "    models    - List the trained AIs in the model store."
+	print "    sweep *   - Search the hyperparameters of an AI type: MLP, RBF"
+	print "    crossval * - Cross-validate an AI type: MLP, RBF, DTree"
 	print
 
 
-def select_ai( cl, data, targets, original_import ):
+def select_ai( cl, data ):
 	""" Select an AI. Create in instance of the needed class and return it. """
 	ai = None
 
 	# MLP
 	if cl == "MLP":
 		ai = mlp.MLP(
-			data, targets,
+			data.floats(), data.targets(),
 			hidden_nodes = MLP_HIDDEN_NODES, beta = MLP_BETA, momentum = MLP_MOMENTUM
 		)
 		print "MLP created."
 
 	# RBF
 	elif cl == "RBF":
-		# Adjust target format for RBF: [win, draw, loss]
-		targets_rbf = ny.zeros( ( len( targets ), 3 ) )
-		for i in range( len( targets ) ):
-			win = 1 if targets[i] == WIN else 0
-			draw = 1 if targets[i] == DRAW else 0
-			loss = 1 if targets[i] == LOSS else 0
-			targets_rbf[i] = [win, draw, loss]
-
+		# Target format for RBF: [win, draw, loss]
 		ai = rbf.RBF(
-			data, targets_rbf,
-			sigma = RBF_SIGMA, rbfs_amount = RBF_NODES, use_kmeans = RBF_KMEANS, normalize = RBF_NORMALIZE
+			data.floats(), data.one_hot(),
+			sigma = RBF_SIGMA, rbfs_amount = RBF_NODES, use_kmeans = RBF_KMEANS, normalize = RBF_NORMALIZE,
+			solver = RBF_SOLVER, ridge = RBF_RIDGE
 		)
 
 		print "RBF created."
 
 	# DTree
 	elif cl == "DTree":
-		data = []
-		for value in original_import:
-			zipped = zip( DATA_ATTRIBUTES, [datum for datum in value] )
-			data.append( dict( zipped ) )
 		ai = dtree.DTree( data, DATA_ATTRIBUTES, DT_TARGET_ATTRIBUTE )
 
 		print "DTree created."
@@ -139,22 +105,56 @@ def select_ai( cl, data, targets, original_import ):
 	return ai
 
 
-def train_ai( ai, valid, validtargets ):
-	""" Train the previously selected AI. """
+def train_ai( ai, valid, validtargets, resume = False, models = None, data = None ):
+	""" Train the previously selected AI.
+	Unless resuming, the training starts over with a new AI of the same type with the
+	settings of the config, imported or trained weights are not continued. With a model
+	store and a fixed SEED the AI is only trained if the store has no model trained with
+	the same settings and data, otherwise that one is imported.
+
+	resume -- Continue the training of an MLP from its last checkpoint.
+	models -- Model store. Default: None
+	data   -- Training data as dataset.Dataset. Not needed for resuming.
+	Returns the trained AI.
+	"""
 
 	if not ai:
 		print "Training not possible. You have to select an AI type first."
 	else:
+		model_type = ai.__class__.__name__
+		key = None
+
+		ny.random.seed( SEED )
+
+		if not resume:
+			# Created after seeding, so the settings, data and seed determine the trained model
+			ai = select_ai( model_type, data )
+
+			if models is not None and SEED is not None and model_type in store.PREFIXES:
+				params = store.params( model_type )
+				checksum = data.checksum()
+				key = store.key( model_type, params, checksum, SEED )
+				filename = models.lookup( key )
+				if filename:
+					ai.import_ai( filename )
+					print "Imported the trained AI from the model store (%s)." % key[:12]
+					return ai
+
 		# MLP
 		if isinstance( ai, mlp.MLP ):
 			ai.early_stopping(
 				valid, validtargets,
-				eta = MLP_ETA, iterations = MLP_ITER, outtype = MLP_OUTTYPE
+				eta = MLP_ETA, iterations = MLP_ITER, outtype = MLP_OUTTYPE,
+				batch_size = MLP_BATCH_SIZE, resume = resume, seed = SEED
 			)
 
 		# RBF
 		elif isinstance( ai, rbf.RBF ):
-			ai.train( eta = RBF_ETA, iterations = RBF_ITER )
+			ai.train(
+				eta = RBF_ETA, iterations = RBF_ITER,
+				kmeans_init = RBF_KMEANS_INIT, kmeans_n_init = RBF_KMEANS_N_INIT,
+				kmeans_batch = RBF_KMEANS_BATCH, kmeans_iter = RBF_KMEANS_ITER
+			)
 
 		# DTree
 		elif isinstance( ai, dtree.DTree ):
@@ -163,8 +163,44 @@ def train_ai( ai, valid, validtargets ):
 		else:
 			print "Training not possible. Unknown AI."
 
+		if key:
+			models.add( key, ai, { "type": model_type, "params": params, "checksum": checksum, "seed": SEED } )
+
 		print "Training completed."
 
+	return ai
+
+
+
+def stream_ai( ai ):
+	""" Train the selected MLP with the file of training data read chunk by chunk,
+	for files larger than the memory. Only one chunk is held in memory at a time.
+	DATA_STREAM_VALID of the boards are kept for validation, the boards are not normalized.
+	"""
+
+	if not isinstance( ai, mlp.MLP ):
+		print "Streaming is only possible for the MLP."
+		return
+
+	# The same seed for every pass, so the validation boards are never trained with
+	seed = SEED if SEED is not None else ny.random.randint( 2 ** 31 - 1 )
+
+	def chunks( part ):
+		return dataset.stream(
+			FILE_DATA, limit = DATA_LIMIT, valid_fraction = DATA_STREAM_VALID, part = part, seed = seed
+		)
+
+	boards, outcomes = zip( *[chunk.categorical() for chunk in chunks( "valid" )] )
+	valid = dataset.Dataset( ny.concatenate( boards ), ny.concatenate( outcomes ) )
+
+	ny.random.seed( SEED )
+	ai.early_stopping(
+		valid.floats(), valid.targets(), eta = MLP_ETA, iterations = 1, outtype = MLP_OUTTYPE,
+		checkpoint = None, stream = lambda: chunks( "train" )
+	)
+
+	print "Training completed."
+
 
 
 if __name__ == "__main__":
@@ -174,13 +210,15 @@ if __name__ == "__main__":
 	print
 
 	# Import data for training
-	data, targets, original_import = import_traindata( FILE_DATA )
+	data = import_traindata( FILE_DATA )
 
-	shuffle = range( DATA_LIMIT )
+	ny.random.seed( SEED )
+	shuffle = range( len( data ) )
 	ny.random.shuffle( shuffle )
-	data, targets = data[shuffle,:], targets[shuffle,:]
-	valid, validtargets = data[:int( DATA_LIMIT / 3 )], targets[:int( DATA_LIMIT / 3 )]
+	data = data.take( shuffle )
+	valid = data.take( slice( 0, int( len( data ) / 3 ) ) )
 
+	models = store.Store()
 	ai = False
 
 	# Main loop
@@ -200,13 +238,22 @@ if __name__ == "__main__":
 		elif cl.startswith( "select " ):
 			cl = cl.replace( "select ", "" )
 
-			ai = select_ai( cl, data, targets, original_import )
+			ai = select_ai( cl, data )
 			if ai is None:
 				print "ERROR: Unknown AI."
 
 		# Training
 		elif cl == "train":
-			train_ai( ai, valid, validtargets )
+			ai = train_ai( ai, valid.floats(), valid.targets(), models = models, data = data )
+
+		elif cl == "stream":
+			stream_ai( ai )
+
+		elif cl == "resume":
+			try:
+				train_ai( ai, valid.floats(), valid.targets(), resume = True )
+			except ValueError as e:
+				print "ERROR: %s" % e
 
 		# Start a game with the trained AI
 		elif cl == "play":
@@ -227,5 +274,50 @@ if __name__ == "__main__":
 			ai.import_ai()
 			print "Import completed."
 
+		# Convert exports in the text format.
+		# Existing binary exports are never overwritten, they may be newer than the text.
+		elif cl == "convert":
+			for module, file_in, file_out in (
+				( mlp, MLP_EXPORT_FILE_TXT, MLP_EXPORT_FILE ),
+				( rbf, RBF_EXPORT_FILE_TXT, RBF_EXPORT_FILE ),
+				( dtree, DT_EXPORT_FILE_TXT, DT_EXPORT_FILE )
+			):
+				if not os.path.exists( file_in ):
+					continue
+				if os.path.exists( file_out ):
+					print "Skipped %s: %s already exists. Remove it to convert again." % ( file_in, file_out )
+					continue
+				module.convert( file_in, file_out )
+				print "Converted %s to %s." % ( file_in, file_out )
+
+		# Search the hyperparameters
+		elif cl.startswith( "sweep " ):
+			cl = cl.replace( "sweep ", "" )
+
+			if cl in SWEEP_SPACES:
+				results = sweep.run( cl, data )
+				print "Best settings: %s" % results[0]["settings"]
+				print "Results written to %s." % ( SWEEP_RESULTS_FILE % cl.lower() )
+			else:
+				print "ERROR: Unknown AI."
+
+		# Cross-validation
+		elif cl.startswith( "crossval " ):
+			cl = cl.replace( "crossval ", "" )
+
+			if cl in ( "MLP", "RBF", "DTree" ):
+				print "%d-fold cross-validation of %s:" % ( CROSSVAL_FOLDS, cl )
+				print crossval.report( crossval.run( cl, data ) )
+			else:
+				print "ERROR: Unknown AI."
+
+		# List the trained AIs in the model store
+		elif cl == "models":
+			for info in models.entries():
+				print "%s  %-5s  %8d bytes  seed %s  last used %s" % (
+					info["key"][:12], info["type"], info["size"], info["seed"],
+					time.strftime( "%Y-%m-%d %H:%M", time.localtime( info["used"] ) )
+				)
+
 		elif cl != "":
 			print "Unknown command."
\ No newline at end of file
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os, struct, json
+import numpy as ny
+
+
+# Layout of a binary file:
+#   8 bytes  magic string of the file type
+#   8 bytes  length of the header (unsigned little-endian)
+#   header   JSON with version, meta data and name, dtype, shape and offset of each array
+#   arrays   raw array buffers, each one starting at a multiple of ALIGN
+ALIGN = 64
+
+
+def _aligned( n ):
+	""" Round n up to the next multiple of ALIGN. """
+
+	return ( n + ALIGN - 1 ) // ALIGN * ALIGN
+
+
+def is_binfile( filename, magic ):
+	""" Returns True if the file starts with the given magic string. """
+
+	f = open( filename, "rb" )
+	start = f.read( len( magic ) )
+	f.close()
+
+	return start == magic
+
+
+def write( filename, magic, version, meta, arrays ):
+	""" Write arrays and meta data into a binary file.
+	The file is written under a temporary name first and then
+	moved into place, so readers never see a half-written file.
+
+	filename -- File to write.
+	magic    -- String of 8 characters identifying the file type.
+	version  -- Version number of the file type.
+	meta     -- Dict with additional values. Has to be serializable as JSON.
+	arrays   -- List of ( name, array ) tuples.
+	"""
+
+	arrays = [( name, ny.ascontiguousarray( a ) ) for name, a in arrays]
+	header = { "version": version, "meta": meta, "arrays": [] }
+
+	# Every entry has the same size, so the offsets can be computed in advance.
+	entries = [[name, a.dtype.str, list( a.shape ), 0] for name, a in arrays]
+	header["arrays"] = entries
+	offset = _aligned( 16 + len( json.dumps( header ) ) + 20 * len( entries ) )
+	for entry, ( name, a ) in zip( entries, arrays ):
+		entry[3] = offset
+		offset = _aligned( offset + a.nbytes )
+	header = json.dumps( header )
+
+	tmp = filename + ".tmp"
+	f = open( tmp, "wb" )
+	f.write( magic )
+	f.write( struct.pack( "<Q", len( header ) ) )
+	f.write( header )
+	for entry, ( name, a ) in zip( entries, arrays ):
+		f.write( "\0" * ( entry[3] - f.tell() ) )
+		f.write( a.tostring() )
+	f.close()
+
+	if os.name == "nt" and os.path.exists( filename ):
+		os.remove( filename )
+	os.rename( tmp, filename )
+
+
+def read( filename, magic, mmap = True ):
+	""" Read a binary file written by write().
+
+	filename -- File to read.
+	magic    -- Expected magic string of the file type.
+	mmap     -- Memory-map the arrays read-only instead of reading them. Default: True
+	Returns a tuple in the form: ( version, meta, dict of arrays ).
+	"""
+
+	f = open( filename, "rb" )
+	if f.read( len( magic ) ) != magic:
+		f.close()
+		raise ValueError( "%s is not a file of type %s." % ( filename, magic.strip( "\0" ) ) )
+	length = struct.unpack( "<Q", f.read( 8 ) )[0]
+	header = json.loads( f.read( length ) )
+
+	arrays = {}
+	for name, dtype, shape, offset in header["arrays"]:
+		name, dtype, shape = str( name ), ny.dtype( str( dtype ) ), tuple( shape )
+		count = int( ny.prod( shape ) )
+		if mmap and count > 0:
+			arrays[name] = ny.memmap( filename, dtype, "r", offset, shape )
+		else:
+			f.seek( offset )
+			arrays[name] = ny.fromfile( f, dtype, count ).reshape( shape )
+	f.close()
+
+	return header["version"], header["meta"], arrays
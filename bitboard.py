@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from global_vars import *
+
+
+# Bit layout: Every column uses FIELD_HEIGHT + 1 bits, the cell (x,y) is
+# bit x * ( FIELD_HEIGHT + 1 ) + y. The additional top bit of each column
+# always stays empty and stops shifted lines from wrapping into the next column.
+COLUMN_BITS = FIELD_HEIGHT + 1
+
+# Shifts to the neighbouring cell: up, right, diagonal right down, diagonal right up
+DIRECTIONS = ( 1, COLUMN_BITS, COLUMN_BITS - 1, COLUMN_BITS + 1 )
+
+BOTTOM_MASK = 0
+for _x in range( FIELD_WIDTH ):
+	BOTTOM_MASK |= 1 << ( _x * COLUMN_BITS )
+BOARD_MASK = BOTTOM_MASK * ( ( 1 << FIELD_HEIGHT ) - 1 )
+COLUMN_MASKS = [( ( 1 << FIELD_HEIGHT ) - 1 ) << ( _x * COLUMN_BITS ) for _x in range( FIELD_WIDTH )]
+
+
+def has_won( bits ):
+	""" Returns True if the stones in bits contain a connected line. """
+
+	for d in DIRECTIONS:
+		line = bits
+		for i in range( 1, CONNECT ):
+			line &= bits >> ( i * d )
+		if line:
+			return True
+
+	return False
+
+
+def winning_cells( bits ):
+	""" Returns a mask of all cells, which would complete a
+	line for the stones in bits if a stone was placed there.
+	The mask also contains already occupied cells.
+	"""
+
+	cells = 0
+
+	for d in DIRECTIONS:
+		# k is the position of the missing stone in the line
+		for k in range( CONNECT ):
+			line = BOARD_MASK
+			for i in range( CONNECT ):
+				if i == k:
+					continue
+				shift = ( i - k ) * d
+				if shift > 0:
+					line &= bits >> shift
+				else:
+					line &= bits << -shift
+			cells |= line
+
+	return cells & BOARD_MASK
+
+
+def columns( mask ):
+	""" Returns the list of columns with at least one cell in the mask. """
+
+	return [x for x in range( FIELD_WIDTH ) if mask & COLUMN_MASKS[x]]
+
+
+class Bitboard:
+	""" Connect Four board as bitboards.
+	One integer per player for the stones and the height of every column.
+	"""
+
+	def __init__( self ):
+		""" Constructor. """
+
+		self.stones = { STONE_HUMAN: 0, STONE_AI: 0 }
+		self.heights = [0] * FIELD_WIDTH
+		self.moves = []
+
+
+	def mask( self ):
+		""" Returns a mask of all occupied cells. """
+
+		return self.stones[STONE_HUMAN] | self.stones[STONE_AI]
+
+
+	def legal_moves( self ):
+		""" Returns a mask of the cells where a stone can be placed next. """
+
+		return ( self.mask() + BOTTOM_MASK ) & BOARD_MASK
+
+
+	def threats( self, stone ):
+		""" Returns a mask of the cells where the player with the given
+		stone would win with the next move.
+		"""
+
+		return winning_cells( self.stones[stone] ) & self.legal_moves()
+
+
+	def play( self, col, stone ):
+		""" Place a stone in a column. """
+
+		self.stones[stone] |= 1 << ( col * COLUMN_BITS + self.heights[col] )
+		self.heights[col] += 1
+		self.moves.append( ( col, stone ) )
+
+
+	def undo( self ):
+		""" Take back the last move. """
+
+		col, stone = self.moves.pop()
+		self.heights[col] -= 1
+		self.stones[stone] ^= 1 << ( col * COLUMN_BITS + self.heights[col] )
+
+
+	def winner( self ):
+		""" Returns the stone value of the winner or the value
+		of a blank stone if there is no winner yet.
+		"""
+
+		for stone in ( STONE_AI, STONE_HUMAN ):
+			if has_won( self.stones[stone] ):
+				return stone
+
+		return STONE_BLANK
+
+
+	def is_full( self ):
+		""" Returns True if there are no more free fields, False otherwise. """
+
+		return self.mask() == BOARD_MASK
+
+
+
+if __name__ == "__main__":
+	# Small test
+	b = Bitboard()
+	for x in range( CONNECT - 1 ):
+		b.play( x, STONE_HUMAN )
+		b.play( x, STONE_AI )
+	print "Threat human: %s" % columns( b.threats( STONE_HUMAN ) )
+	print "Threat AI:    %s" % columns( b.threats( STONE_AI ) )
+	b.play( CONNECT - 1, STONE_HUMAN )
+	print "Winner human: %s" % ( b.winner() == STONE_HUMAN )
+	b.undo()
+	print "After undo:   %s" % ( b.winner() == STONE_BLANK )
+
+	b = Bitboard()
+	for x in range( CONNECT ):
+		for y in range( x ):
+			b.play( x, STONE_HUMAN )
+		b.play( x, STONE_AI )
+	print "Diagonal:     %s" % ( b.winner() == STONE_AI )
+
+	b = Bitboard()
+	for i in range( CONNECT ):
+		b.play( 0, STONE_AI )
+	print "Vertical:     %s" % ( b.winner() == STONE_AI )
+	print "Full:         %s" % b.is_full()
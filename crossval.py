@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from global_vars import *
+import os, sys, tempfile, multiprocessing, numpy as ny
+import mlp, rbf, dtree, binfile, dataset
+
+
+# Temporary file sharing the data with the worker processes
+SHARED_MAGIC = "C4CROSSV"
+
+# Columns of the confusion matrix: The outcomes and boards the decision tree has no branch for
+PREDICTIONS = OUTCOMES + ["unknown"]
+
+
+def run( model_type, data, folds = CROSSVAL_FOLDS, processes = CROSSVAL_WORKERS ):
+	""" k-fold cross-validation of an AI type with the settings of the global config.
+	Every board is assigned to one fold. Each fold is predicted by an AI trained
+	with all other folds. The folds are trained in parallel worker processes.
+
+	model_type -- AI type to validate: "MLP", "RBF" or "DTree"
+	data       -- Dataset to split into folds.
+	folds      -- Number of folds.
+	processes  -- Worker processes for the folds. 0 for one per CPU.
+	Returns the confusion matrix: One row per true outcome, one column per
+	predicted outcome (PREDICTIONS), each one summed over all folds.
+	"""
+
+	# Fold of each board
+	fold_of = ny.random.permutation( len( data ) ) % folds
+
+	handle, shared = tempfile.mkstemp( ".tmp", "crossval-" )
+	os.close( handle )
+
+	try:
+		boards, outcomes = data.categorical()
+		binfile.write( shared, SHARED_MAGIC, 1, {}, [
+			( "boards", boards ), ( "outcomes", outcomes ), ( "fold_of", fold_of )
+		] )
+		pool = multiprocessing.Pool( min( processes or multiprocessing.cpu_count(), folds ), _init_worker, ( shared, ) )
+
+		try:
+			tasks = [( model_type, fold, ny.random.randint( 2 ** 31 - 1 ) ) for fold in range( folds )]
+			confusions = pool.map( _fold_worker, tasks )
+		finally:
+			pool.close()
+			pool.join()
+	finally:
+		os.remove( shared )
+
+	return sum( confusions )
+
+
+def report( confusion ):
+	""" Returns the confusion matrix, the accuracy of each outcome and the overall accuracy as text. """
+
+	lines = ["%-8s" % "" + "".join( "%10s" % label for label in PREDICTIONS ) + "%10s" % "accuracy"]
+
+	for i, label in enumerate( OUTCOMES ):
+		total = confusion[i].sum()
+		accuracy = float( confusion[i, i] ) / total if total else 0.0
+		lines.append( "%-8s" % label + "".join( "%10d" % n for n in confusion[i] ) + "%10.4f" % accuracy )
+
+	lines.append( "Accuracy: %.4f" % ( float( ny.trace( confusion ) ) / max( confusion.sum(), 1 ) ) )
+
+	return "\n".join( lines )
+
+
+
+# Data of the worker processes validating folds
+_worker = {}
+
+
+def _init_worker( filename ):
+	""" Initialise a worker process with the memory-mapped data. """
+
+	version, meta, arrays = binfile.read( filename, SHARED_MAGIC )
+	_worker["data"] = dataset.Dataset( arrays["boards"], arrays["outcomes"] )
+	_worker["fold_of"] = arrays["fold_of"]
+
+
+def _fold_worker( task ):
+	""" Train with all but one fold and predict that fold in a worker process.
+
+	task -- Tuple in the form: ( AI type, fold, seed ).
+	Returns the confusion matrix of the fold.
+	"""
+
+	model_type, fold, seed = task
+	data, fold_of = _worker["data"], _worker["fold_of"]
+
+	train = data.take( ny.flatnonzero( fold_of != fold ) )
+	test = data.take( ny.flatnonzero( fold_of == fold ) )
+	ny.random.seed( seed )
+
+	if model_type == "MLP":
+		# Early stopping with the first third of the training folds, like VG does with the training data
+		valid = train.take( slice( 0, len( train ) // 3 ) )
+		net = mlp.MLP(
+			train.floats(), train.targets(),
+			hidden_nodes = MLP_HIDDEN_NODES, beta = MLP_BETA, momentum = MLP_MOMENTUM
+		)
+		net.early_stopping(
+			valid.floats(), valid.targets(),
+			eta = MLP_ETA, iterations = MLP_ITER, outtype = MLP_OUTTYPE,
+			batch_size = MLP_BATCH_SIZE, checkpoint = None
+		)
+		outputs = net.predict_batch( test.floats() )
+		predicted = ny.abs( outputs - ny.array( OUTCOME_TARGETS, dtype = DTYPE ) ).argmin( axis = 1 )
+
+	elif model_type == "RBF":
+		net = rbf.RBF(
+			train.floats(), train.one_hot(),
+			sigma = RBF_SIGMA, rbfs_amount = RBF_NODES, use_kmeans = RBF_KMEANS, normalize = RBF_NORMALIZE,
+			solver = RBF_SOLVER, ridge = RBF_RIDGE
+		)
+		# The worker process can not start the processes for several runs of k-means.
+		net.train(
+			eta = RBF_ETA, iterations = RBF_ITER,
+			kmeans_init = RBF_KMEANS_INIT, kmeans_n_init = 1,
+			kmeans_batch = RBF_KMEANS_BATCH, kmeans_iter = RBF_KMEANS_ITER
+		)
+		predicted = net.predict_batch( test.floats() )[1].argmax( axis = 1 )
+
+	else:
+		tree = dtree.DTree( train, DATA_ATTRIBUTES, DT_TARGET_ATTRIBUTE, processes = 1 )
+		tree.train()
+		codes = dict( zip( PREDICTIONS, range( len( PREDICTIONS ) ) ) )
+		predicted = ny.array( [codes[outcome] for outcome in tree.predict_batch( test.boards )] )
+
+	confusion = ny.bincount(
+		test.outcomes.astype( ny.intp ) * len( PREDICTIONS ) + predicted,
+		minlength = len( OUTCOMES ) * len( PREDICTIONS )
+	)
+
+	return confusion.reshape( len( OUTCOMES ), len( PREDICTIONS ) )
+
+
+
+if __name__ == "__main__":
+	# Usage: crossval.py MLP|RBF|DTree
+	model_type = sys.argv[1] if len( sys.argv ) > 1 else "DTree"
+
+	data = dataset.load( FILE_DATA )
+	ny.random.seed( SEED )
+	data = data.take( ny.random.permutation( len( data ) )[:DATA_LIMIT] )
+
+	print "%d-fold cross-validation of %s:" % ( CROSSVAL_FOLDS, model_type )
+	print report( run( model_type, data ) )
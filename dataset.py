@@ -0,0 +1,262 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from global_vars import *
+import os, hashlib, itertools, numpy as ny
+import binfile
+
+
+# Explanation for the trainings data:
+# Every line contains equal amounts of x and o stones.
+# The win/loss/draw indicates the outcome for the next
+# player, if both follow a perfect plan.
+
+
+CACHE_MAGIC = "C4DATA\0\0"
+CACHE_VERSION = 1
+
+STONE_CODES = dict( ( label, int( stone ) ) for label, stone in STONE_LABELS.items() )
+OUTCOME_CODES = dict( zip( OUTCOMES, range( len( OUTCOMES ) ) ) )
+
+
+class Dataset:
+	""" Training data for all AI types.
+	The boards are stored as int8 matrix with the stone values and the outcomes
+	as codes (index in OUTCOMES). Every AI type gets its view of the same data.
+	"""
+
+	def __init__( self, boards, outcomes ):
+		""" Constructor.
+
+		boards   -- Matrix with one board per row, the cells hold the stone values.
+		outcomes -- Outcome code for each board.
+		"""
+
+		self.boards = boards
+		self.outcomes = outcomes
+		self._floats = None
+
+
+	def __len__( self ):
+		""" Returns the number of boards. """
+
+		return len( self.boards )
+
+
+	def take( self, indices ):
+		""" Returns a new dataset with the selected boards.
+		With a slice the new dataset shares the memory of this one.
+
+		indices -- List, index array or slice of the boards to use.
+		"""
+
+		subset = Dataset( self.boards[indices], self.outcomes[indices] )
+		if self._floats is not None:
+			subset._floats = self._floats[indices]
+
+		return subset
+
+
+	def floats( self ):
+		""" Returns the boards as float matrix.
+		The matrix is created once and shared by all AI types using it.
+		"""
+
+		if self._floats is None:
+			self._floats = self.boards.astype( DTYPE )
+
+		return self._floats
+
+
+	def targets( self ):
+		""" Returns the outcomes as column of target values (WIN, DRAW, LOSS). """
+
+		return ny.array( OUTCOME_TARGETS, dtype = DTYPE )[self.outcomes].reshape( -1, 1 )
+
+
+	def one_hot( self ):
+		""" Returns the outcomes in the format [win, draw, loss]. """
+
+		return ny.eye( len( OUTCOMES ), dtype = DTYPE )[self.outcomes]
+
+
+	def checksum( self ):
+		""" Returns the MD5 checksum of the boards and outcomes. """
+
+		md5 = hashlib.md5()
+		md5.update( ny.ascontiguousarray( self.boards ).tostring() )
+		md5.update( ny.ascontiguousarray( self.outcomes ).tostring() )
+
+		return md5.hexdigest()
+
+
+	def categorical( self ):
+		""" Returns the boards and outcome codes as they are stored. """
+
+		return self.boards, self.outcomes
+
+
+	def records( self ):
+		""" Returns the data in its original string format.
+		One list of labels per board with the outcome as last value.
+		All lists share the same few label strings.
+		"""
+
+		labels = ny.empty( 3, dtype = object )
+		for label, stone in STONE_LABELS.items():
+			labels[int( stone ) + 1] = label
+
+		cells = ny.empty( ( len( self ), DATA_NUM_ATTR ), dtype = object )
+		cells[:,:-1] = labels[ny.asarray( self.boards ) + 1]
+		cells[:,-1] = ny.array( OUTCOMES, dtype = object )[self.outcomes]
+
+		return cells.tolist()
+
+
+
+def checksum( filename ):
+	""" Returns the MD5 checksum of a file. """
+
+	md5 = hashlib.md5()
+	f = open( filename, "rb" )
+	for block in iter( lambda: f.read( 1 << 20 ), "" ):
+		md5.update( block )
+	f.close()
+
+	return md5.hexdigest()
+
+
+def parse_lines( lines ):
+	""" Parse lines of training data. Lines with a wrong number of attributes are skipped.
+
+	Returns the boards as int8 matrix and the outcome codes (index in OUTCOMES).
+	"""
+
+	boards, results = [], []
+
+	for line in lines:
+		row = line.strip().split( ',' )
+		if len( row ) != DATA_NUM_ATTR:
+			continue
+		boards.append( [STONE_CODES[x] for x in row[:-1]] )
+		results.append( OUTCOME_CODES[row[-1]] )
+
+	boards = ny.array( boards, dtype = ny.int8 ).reshape( -1, DATA_NUM_ATTR - 1 )
+
+	return boards, ny.array( results, dtype = ny.int8 )
+
+
+def parse( file_in ):
+	""" Parse the text file with training data.
+
+	Returns the boards as int8 matrix and the outcome codes (index in OUTCOMES).
+	"""
+
+	f = open( file_in, "r" )
+	boards, outcomes = parse_lines( f )
+	f.close()
+
+	return boards, outcomes
+
+
+def stream( file_in, chunk_size = DATA_CHUNK_SIZE, limit = 0, sample = 1.0,
+		valid_fraction = 0.0, part = "train", seed = 0 ):
+	""" Read the text file with training data chunk by chunk.
+	Only one chunk at a time is held in memory. Every board is randomly assigned to the
+	training or validation part and sampled with two random numbers drawn for it in the
+	order of the file. The split and the sampling only depend on the seed and the position
+	of the board in the file, not on chunk_size or limit. With the same seed the two parts
+	never overlap.
+
+	file_in        -- Text file with training data.
+	chunk_size     -- Number of boards per chunk. Only the last chunk may be smaller.
+	limit          -- Only use the first lines of the file. 0 for no limit.
+	sample         -- Fraction of the boards to use. Default: 1.0
+	valid_fraction -- Fraction of the boards reserved for validation. Default: 0.0
+	part           -- Part of the split to return: "train" or "valid"
+	seed           -- Seed for the split and the sampling.
+	Yields Dataset chunks.
+	"""
+
+	rng = ny.random.RandomState( seed )
+	pending_boards, pending_outcomes, pending = [], [], 0
+
+	f = open( file_in, "r" )
+	lines = f if limit <= 0 else itertools.islice( f, limit )
+
+	try:
+		while True:
+			block = list( itertools.islice( lines, chunk_size ) )
+			if not block:
+				break
+
+			boards, outcomes = parse_lines( block )
+			# One row of random numbers per board, the same rows whatever the chunks are
+			split, sampling = rng.random_sample( ( len( boards ), 2 ) ).T
+
+			keep = sampling < sample
+			if part == "valid":
+				keep &= split < valid_fraction
+			else:
+				keep &= split >= valid_fraction
+
+			pending_boards.append( boards[keep] )
+			pending_outcomes.append( outcomes[keep] )
+			pending += keep.sum()
+
+			while pending >= chunk_size:
+				boards = ny.concatenate( pending_boards )
+				outcomes = ny.concatenate( pending_outcomes )
+				yield Dataset( boards[:chunk_size], outcomes[:chunk_size] )
+
+				pending_boards, pending_outcomes = [boards[chunk_size:]], [outcomes[chunk_size:]]
+				pending -= chunk_size
+
+		if pending > 0:
+			yield Dataset( ny.concatenate( pending_boards ), ny.concatenate( pending_outcomes ) )
+	finally:
+		f.close()
+
+
+def load( file_in, file_cache = None ):
+	""" Load the training data from the binary cache.
+	If the cache is missing or does not match the checksum of
+	the text file, the text file is parsed and the cache rewritten.
+
+	file_in    -- Text file with training data.
+	file_cache -- Binary cache of the file. Default: file_in with FILE_DATA_CACHE_EXT appended.
+	Returns a Dataset. The boards and outcomes are memory-mapped from the cache.
+	"""
+
+	file_cache = file_cache or file_in + FILE_DATA_CACHE_EXT
+	md5 = checksum( file_in )
+
+	if os.path.exists( file_cache ) and binfile.is_binfile( file_cache, CACHE_MAGIC ):
+		version, meta, arrays = binfile.read( file_cache, CACHE_MAGIC )
+		if version == CACHE_VERSION and meta["checksum"] == md5:
+			return Dataset( arrays["boards"], arrays["outcomes"] )
+
+	boards, outcomes = parse( file_in )
+	binfile.write(
+		file_cache, CACHE_MAGIC, CACHE_VERSION, { "checksum": md5 },
+		[( "boards", boards ), ( "outcomes", outcomes )]
+	)
+
+	return Dataset( boards, outcomes )
+
+
+
+if __name__ == "__main__":
+	print "Streaming %s with different chunk sizes:" % FILE_DATA
+	data = load( FILE_DATA )
+	parts = {}
+	for part, chunk_size in ( ( "train", 1000 ), ( "valid", 4096 ), ( "train", 4096 ) ):
+		chunks = list( stream( FILE_DATA, chunk_size, valid_fraction = 0.25, part = part, seed = 1 ) )
+		parts[part, chunk_size] = ny.concatenate( [chunk.boards for chunk in chunks] )
+		print "  %s part with chunks of %d: %d boards" % ( part, chunk_size, len( parts[part, chunk_size] ) )
+
+	print "Same training part: %s" % ny.array_equal( parts["train", 1000], parts["train", 4096] )
+	both = ny.concatenate( ( parts["train", 1000], parts["valid", 4096] ) )
+	print "Every board in exactly one part: %s" % (
+		sorted( row.tostring() for row in both ) == sorted( row.tostring() for row in data.boards )
+	)
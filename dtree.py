@@ -2,8 +2,21 @@
 # -*- coding: utf-8 -*-
 
 from global_vars import *
-import numpy as ny
+import os, copy, tempfile, multiprocessing, numpy as ny
 import ast
+import binfile, dataset
+
+
+# Attributes with gains closer than this to the best one are compared
+# again with the arithmetic of the original list based builder.
+GAIN_EPS = 1e-9
+
+# Temporary file sharing the training data with the worker processes
+SHARED_MAGIC = "C4DTSHR\0"
+
+# Binary export format
+EXPORT_MAGIC = "C4DTREE\0"
+EXPORT_VERSION = 1
 
 
 class DTree:
@@ -13,177 +26,820 @@ class DTree:
 	"""
 
 
-	def __init__( self, data, attributes, target_attr ):
+	def __init__( self, data, attributes, target_attr, processes = DT_WORKERS,
+			parallel_min_size = DT_PARALLEL_MIN_SIZE, max_depth = DT_MAX_DEPTH,
+			min_samples = DT_MIN_SAMPLES, min_gain = DT_MIN_GAIN, prune_fraction = DT_PRUNE_FRACTION ):
 		""" Constructor.
 
-		data        -- Training data.
-		attributes  -- Name of attributes in data.
-		target_attr -- The attribute in the data which is the classification to reach.
+		data              -- Training data. Either a Dataset, dicts or sequences of values in the order of the attributes.
+		                     The boards of a Dataset are the attributes in order without the target attribute.
+		attributes        -- Name of attributes in data.
+		target_attr       -- The attribute in the data which is the classification to reach.
+		processes         -- Worker processes for building the tree. 0 for one per CPU, 1 for none.
+		parallel_min_size -- Subtrees with at least this many rows are built by the workers.
+		max_depth         -- Nodes at this depth become leaves. 0 for no limit.
+		min_samples       -- Nodes with less rows become leaves.
+		min_gain          -- Nodes are only split if the highest information gain reaches this value.
+		prune_fraction    -- Fraction of the training data held out for reduced-error pruning. 0 for no pruning.
 		"""
 
-		self.data = data[:]
 		self.attributes = attributes[:]
 		self.target_attr = target_attr
 		self.tree = None
+		self._compiled = None
+		self.processes = processes
+		self.parallel_min_size = parallel_min_size
+		self.max_depth = max_depth
+		self.min_samples = min_samples
+		self.min_gain = min_gain
+		self.prune_fraction = prune_fraction
+
+		# Attributes to split on, in the order of the columns of the code matrix.
+		target = self.attributes.index( target_attr )
+		self.features = [attr for attr in self.attributes if attr != target_attr]
+
+		if isinstance( data, dataset.Dataset ):
+			self.codes, self.targets = data.categorical()
+			# The stone values -1, 0, 1 become the codes 0, 1, 2.
+			self.codes = ny.asarray( self.codes ) + 1
+			stone_labels = [None] * len( STONE_LABELS )
+			for label, stone in STONE_LABELS.items():
+				stone_labels[int( stone ) + 1] = label
+			self.labels = [stone_labels] * len( self.features )
+			self.target_labels = OUTCOMES[:]
+		else:
+			if data and isinstance( data[0], dict ):
+				data = [[record[attr] for attr in self.attributes] for record in data]
+			columns = zip( *data ) if data else [[]] * len( self.attributes )
+			self.target_labels, self.targets = self._encode( columns[target] )
+			encoded = [self._encode( c ) for i, c in enumerate( columns ) if i != target]
+			self.labels = [labels for labels, codes in encoded]
+			self.codes = ny.array( [codes for labels, codes in encoded], dtype = ny.int8 )
+			self.codes = self.codes.T.reshape( -1, len( self.features ) )
+
+		self.targets = ny.asarray( self.targets, dtype = ny.intp )
+		self.num_values = max( [len( labels ) for labels in self.labels] + [1] )
+
+		# Distinct lists of labels, the last one is the one of the target attribute.
+		distinct = {}
+		self.label_ids = ny.array(
+			[distinct.setdefault( tuple( labels ), len( distinct ) ) for labels in self.labels], dtype = ny.intp
+		)
+		self.label_lists = sorted( distinct, key = distinct.get ) + [tuple( self.target_labels )]
+
+
+	def _encode( self, column ):
+		""" Returns the distinct values of a column and the
+		column with every value replaced by its index.
+		"""
+
+		labels, codes, index = [], [], {}
+		for value in column:
+			if value not in index:
+				index[value] = len( labels )
+				labels.append( value )
+			codes.append( index[value] )
+
+		return labels, ny.array( codes, dtype = ny.int8 )
 
 
 	def train( self ):
-		""" Build the decision tree. """
+		""" Build the decision tree. With a prune_fraction the tree is built
+		from the rest of the training data and then pruned with the held out rows.
+		"""
 
-		self.tree = self._make_tree( self.data, self.attributes, self.target_attr )
+		# n * log2( n ) for all possible counts
+		n = ny.arange( len( self.targets ) + 1, dtype = ny.float64 )
+		self._nlogn = n * ny.log2( ny.maximum( n, 1 ) )
 
+		self._compiled = None
+		indices = ny.arange( len( self.targets ) )
+		used = ny.zeros( len( self.features ), dtype = bool )
 
-	def _make_tree( self, data, attributes, target_attr ):
-		""" Build the decision tree. """
+		held_out = None
+		if self.prune_fraction > 0:
+			held = ny.random.random_sample( len( indices ) ) < self.prune_fraction
+			indices, held_out = indices[~held], indices[held]
 
-		data = data[:]
-		values = [record[self.target_attr] for record in data]
-		default = self._majority_value( data, target_attr )
+		processes = self.processes or multiprocessing.cpu_count()
 
-		if not data or len( attributes ) - 1 <= 0:
-			return default
-		elif values.count( values[0] ) == len( values ):
-			return values[0]
+		if processes > 1 and len( indices ) >= 2 * self.parallel_min_size:
+			self.tree = self._make_tree_parallel( indices, used, processes )
 		else:
-			best = self._choose_attribute( data, attributes, target_attr )
-			tree = { best: {} }
-
-			for value in self._get_values( data, best ):
-				subtree = self._make_tree(
-					self._get_examples( data, best, value ),
-					[attr for attr in attributes if attr != best],
-					target_attr
+			self.tree = self._make_tree( indices, used, 0 )
+
+		if held_out is not None:
+			before, after = self.prune( self.codes[held_out], self.targets[held_out], indices )
+			if VERBOSE:
+				print "[prune] nodes: %d -> %d   depth: %d -> %d   accuracy: %f -> %f" % (
+					before["nodes"], after["nodes"], before["depth"], after["depth"],
+					before["accuracy"], after["accuracy"]
 				)
-				tree[best][value] = subtree
+
+
+	def _make_tree_parallel( self, indices, used, processes ):
+		""" Build the decision tree with a pool of worker processes.
+		The training data is shared through a memory-mapped temporary file,
+		the workers only receive the rows of their subtrees.
+		"""
+
+		handle, filename = tempfile.mkstemp( ".tmp", "dtree-" )
+		os.close( handle )
+
+		try:
+			binfile.write( filename, SHARED_MAGIC, 1, {}, [( "codes", self.codes ), ( "targets", self.targets )] )
+
+			# The workers get the tree without the data and map the data from the file.
+			worker = copy.copy( self )
+			worker.codes, worker.targets = None, None
+			pool = multiprocessing.Pool( processes, _init_worker, ( worker, filename ) )
+
+			try:
+				# Split the top of the tree here, so every worker gets a share of the subtrees.
+				limit = max( len( indices ) // ( 4 * processes ), self.parallel_min_size )
+				tree = self._make_tree( indices, used, 0, pool, limit )
+			finally:
+				pool.close()
+				pool.join()
+		finally:
+			os.remove( filename )
 
 		return tree
 
 
-	def _majority_value( self, data, target_attr ):
-		""" Creates a list of all values in the target attribute for each record
-		in the data, and return the value that appears the most frequently.
+	def _make_tree( self, indices, used, depth, pool = None, limit = 0 ):
+		""" Build the decision tree level by level. All nodes of a level are
+		handled together with one contingency count over their rows.
+
+		indices -- Rows of the training data in the root node.
+		used    -- Attributes already split on, one flag per column of the code matrix.
+		depth   -- Depth of the root node.
+		pool    -- Pool of worker processes to build subtrees. Default: None
+		limit   -- Subtrees with more rows than this are split further before they are given to the pool.
+		Returns the tree.
+		"""
+
+		root = {}
+		subtrees = []
+
+		# Nodes of the current level: their rows (grouped by node in the order of
+		# the training data), the number of rows, the used attributes and the
+		# place in the tree in the form ( dict, key ).
+		rows = ny.asarray( indices, dtype = ny.intp )
+		sizes = ny.array( [len( rows )] )
+		used = used[ny.newaxis]
+		slots = [( root, None )]
+
+		while len( sizes ) > 0:
+			if pool is not None:
+				rows, sizes, used, slots = self._hand_off( pool, subtrees, rows, sizes, used, slots, depth, limit )
+			rows, sizes, used, slots = self._make_level( rows, sizes, used, slots, depth )
+			depth += 1
+
+		# Merge the subtrees built by the workers.
+		for ( parent, key ), result in subtrees:
+			parent[key] = result.get()
+
+		return root[None]
+
+
+	def _hand_off( self, pool, subtrees, rows, sizes, used, slots, depth, limit ):
+		""" Give the nodes of a level with a size between parallel_min_size and
+		limit to the pool. The pending results are added to subtrees.
+
+		Returns the remaining nodes in the same form as the arguments.
+		"""
+
+		hand_off = ( sizes >= self.parallel_min_size ) & ( sizes <= limit )
+		if not hand_off.any():
+			return rows, sizes, used, slots
+
+		ends = ny.cumsum( sizes )
+		for i in ny.flatnonzero( hand_off ):
+			task = ( rows[ends[i] - sizes[i]:ends[i]], used[i], depth )
+			subtrees.append( ( slots[i], pool.apply_async( _make_tree_worker, ( task, ) ) ) )
+
+		keep = ~hand_off
+		rows = rows[ny.repeat( keep, sizes )]
+		slots = [slot for slot, k in zip( slots, keep ) if k]
+
+		return rows, sizes[keep], used[keep], slots
+
+
+	def _make_level( self, rows, sizes, used, slots, depth ):
+		""" Turn the nodes of one level into leaves or split them.
+		The nodes are processed in chunks to limit the size of the contingency table.
+
+		Returns the nodes of the next level in the same form as the arguments.
+		"""
+
+		num_features = len( self.features )
+		cells = num_features * self.num_values * len( self.target_labels )
+		per_chunk = max( DT_COUNT_LIMIT // cells, 1 )
+		ends = ny.cumsum( sizes )
+		children = []
+
+		for first in range( 0, len( sizes ), per_chunk ):
+			last = min( first + per_chunk, len( sizes ) )
+			start = ends[first] - sizes[first]
+			children.append( self._split_nodes(
+				rows[start:ends[last - 1]], sizes[first:last], used[first:last], slots[first:last], depth
+			) )
+
+		next_rows = ny.concatenate( [c[0] for c in children] )
+		next_sizes = ny.concatenate( [c[1] for c in children] )
+		next_used = ny.concatenate( [c[2] for c in children] )
+		next_slots = [slot for c in children for slot in c[3]]
+
+		return next_rows, next_sizes, next_used, next_slots
+
+
+	def _split_nodes( self, rows, sizes, used, slots, depth ):
+		""" Turn nodes into leaves or split them on the attribute with the highest gain.
+
+		rows  -- Rows of the nodes, grouped by node.
+		sizes -- Number of rows of each node.
+		used  -- Attributes already split on for each node.
+		slots -- Place of each node in the tree in the form ( dict, key ).
+		depth -- Depth of the nodes.
+		Returns the child nodes in the same form as the arguments.
+		"""
+
+		num_nodes = len( sizes )
+		num_classes = len( self.target_labels )
+		node = ny.repeat( ny.arange( num_nodes ), sizes )
+		targets = self.targets[rows]
+
+		class_counts = ny.bincount( node * num_classes + targets, minlength = num_nodes * num_classes )
+		class_counts = class_counts.reshape( num_nodes, num_classes )
+		pure = ( class_counts > 0 ).sum( axis = 1 ) == 1
+		exhausted = used.all( axis = 1 )
+		exhausted |= sizes < self.min_samples
+		if self.max_depth > 0 and depth >= self.max_depth:
+			exhausted[:] = True
+		split = ~( pure | exhausted | ( sizes == 0 ) )
+
+		gains, counts = self._gain( rows, node, num_nodes, targets, class_counts )
+		gains[used] = -ny.inf
+		if self.min_gain > 0:
+			weak = split & ( gains.max( axis = 1 ) < self.min_gain )
+			exhausted |= weak
+			split &= ~weak
+
+		ends = ny.cumsum( sizes )
+		for i in ny.flatnonzero( ~split ):
+			parent, key = slots[i]
+			if sizes[i] == 0 or exhausted[i]:
+				parent[key] = self._majority_value( targets[ends[i] - sizes[i]:ends[i]], depth )
+			else:
+				parent[key] = self.target_labels[class_counts[i].argmax()]
+
+		candidates = ( gains >= gains.max( axis = 1 )[:, ny.newaxis] - GAIN_EPS ) & ~used
+		candidates &= split[:, ny.newaxis]
+
+		# Of equal gains the last attribute is chosen. Which gains are equal depends on the
+		# rounding of the original builder, so close ones are calculated again the same way.
+		ties = candidates.sum( axis = 1 ) > 1
+		if ties.any():
+			pair_nodes, pair_features = ny.nonzero( candidates & ties[:, ny.newaxis] )
+			exact = self._sequential_gains(
+				rows, sizes, pair_nodes, pair_features, counts[pair_nodes, pair_features], depth
+			)
+			group_starts = ny.flatnonzero( ny.r_[True, pair_nodes[1:] != pair_nodes[:-1]] )
+			group_max = ny.maximum.reduceat( exact, group_starts )
+			group = ny.cumsum( ny.r_[False, pair_nodes[1:] != pair_nodes[:-1]] )
+			keep = exact == group_max[group]
+			candidates[pair_nodes[~keep], pair_features[~keep]] = False
+
+		num_features = len( self.features )
+		best = num_features - 1 - candidates[:, ::-1].argmax( axis = 1 )
+
+		# Split the rows: one child for every value of the best attribute in a node.
+		in_split = split[node]
+		rows, node = rows[in_split], node[in_split]
+		child_key = node * self.num_values + self.codes[rows, best[node]]
+		order = ny.argsort( child_key, kind = "mergesort" )
+		rows, child_key = rows[order], child_key[order]
+		keys, next_sizes = ny.unique( child_key, return_counts = True )
+		parents, values = ny.divmod( keys, self.num_values )
+
+		branches = {}
+		for i in ny.flatnonzero( split ):
+			parent, key = slots[i]
+			branches[i] = {}
+			parent[key] = { self.features[best[i]]: branches[i] }
+
+		next_used = used[parents]
+		next_used[ny.arange( len( keys ) ), best[parents]] = True
+		next_slots = [
+			( branches[p], self.labels[best[p]][v] ) for p, v in zip( parents.tolist(), values.tolist() )
+		]
+
+		return rows, next_sizes, next_used, next_slots
+
+
+	def _majority_value( self, targets, depth ):
+		""" Returns the value of the target attribute which appears the most frequently.
+		Ties are broken like the set of the values in the order the original builder
+		visited the records would iterate. It reversed the records on every level.
 		"""
 
-		lst = [record[target_attr] for record in data]
+		if len( targets ) == 0:
+			return None
+
+		if depth % 2:
+			targets = targets[::-1]
+
+		counts = ny.bincount( targets )
+		codes, first = ny.unique( targets, return_index = True )
+		values = set()
+		for code in codes[ny.argsort( first )]:
+			values.add( self.target_labels[code] )
+
 		highest_freq = 0
 		most_freq = None
-		unique_lst = list( set( lst ) )
-
-		for val in unique_lst:
-			if lst.count( val ) > highest_freq:
-				most_freq = val
-				highest_freq = lst.count( val )
+		for value in values:
+			freq = counts[self.target_labels.index( value )]
+			if freq > highest_freq:
+				most_freq = value
+				highest_freq = freq
 
 		return most_freq
 
 
-	def _choose_attribute( self, data, attributes, target_attr ):
-		""" Cycles through all the attributes and returns the attribute
-		with the highest information gain (or lowest entropy).
+	def _gain( self, rows, node, num_nodes, targets, class_counts ):
+		""" Calculate the information gain (reduction in entropy) of splitting
+		each node on each attribute. All are counted at once: one bincount
+		over the index ( node, attribute, value, class ).
+		With n * log2( n ) of the counts the gain of a node with N rows is:
+		( NlogN( N ) - sum NlogN( class ) - sum NlogN( value ) + sum NlogN( value and class ) ) / N
+
+		Returns a tuple in the form: ( matrix of gains with one row per node, counts ).
+		"""
+
+		num_features = len( self.features )
+		num_classes = len( self.target_labels )
+
+		index = self.codes[rows].astype( ny.intp )
+		index += ( ( node * num_features )[:, ny.newaxis] + ny.arange( num_features ) ) * self.num_values
+		index *= num_classes
+		index += targets[:, ny.newaxis]
+
+		shape = ( num_nodes, num_features, self.num_values, num_classes )
+		counts = ny.bincount( index.ravel(), minlength = int( ny.prod( shape ) ) ).reshape( shape )
+
+		sizes = class_counts.sum( axis = 1 )
+		nlogn = self._nlogn
+		gains = nlogn[counts].sum( axis = ( 2, 3 ) ) - nlogn[counts.sum( axis = 3 )].sum( axis = 2 )
+		gains += ( nlogn[sizes] - nlogn[class_counts].sum( axis = 1 ) )[:, ny.newaxis]
+		gains /= ny.maximum( sizes, 1 )[:, ny.newaxis]
+
+		return gains, counts
+
+
+	def _sequential_gains( self, rows, sizes, nodes, features, counts, depth ):
+		""" Calculate the information gain of pairs of node and attribute like the
+		original builder, so equal gains of different attributes are rounded the same way.
+		It summed the entropies in the iteration order of dicts, which were filled in
+		the order it visited the records. The records were reversed on every level.
+		The order only matters for sums of at least three terms, for the other pairs
+		any order gives the same result.
+
+		rows     -- Rows of the nodes, grouped by node.
+		sizes    -- Number of rows of each node.
+		nodes    -- Node of each pair.
+		features -- Attribute of each pair.
+		counts   -- Counts of each pair in the form [value, class].
+		depth    -- Depth of the nodes.
+		Returns the gain of each pair.
 		"""
 
-		data = data[:]
-		best_gain = 0.0
-		best_attr = None
+		num_pairs = len( nodes )
+		num_classes = len( self.target_labels )
+		counts = counts.astype( ny.float64 )
+		class_counts = counts.sum( axis = 1 )
+
+		data_order = ny.tile( ny.arange( num_classes ), ( num_pairs, 1 ) )
+		class_order = ny.tile( ny.arange( num_classes ), ( num_pairs, self.num_values, 1 ) )
+		value_order = ny.tile( ny.arange( self.num_values ), ( num_pairs, 1 ) )
+
+		classes_present = ( counts > 0 ).sum( axis = 2 )
+		ordered = ( ( class_counts > 0 ).sum( axis = 1 ) >= 3 ) | ( classes_present >= 3 ).any( axis = 1 )
+		ordered |= ( classes_present >= 2 ).sum( axis = 1 ) >= 3
+		ordered = ny.flatnonzero( ordered )
+
+		if len( ordered ) > 0:
+			# Rows of the node of each pair in the order the original builder visited them
+			lengths = sizes[nodes[ordered]]
+			pair = ny.repeat( ny.arange( len( ordered ) ), lengths )
+			offset = ny.arange( len( pair ) ) - ny.repeat( ny.cumsum( lengths ) - lengths, lengths )
+			if depth % 2:
+				offset = ny.repeat( lengths, lengths ) - 1 - offset
+			pair_rows = rows[ny.repeat( ny.cumsum( sizes )[nodes[ordered]] - lengths, lengths ) + offset]
+
+			values = self.codes[pair_rows, features[ordered][pair]].astype( ny.intp )
+			targets = self.targets[pair_rows]
+			target_ids = ny.full( len( ordered ) * self.num_values, len( self.label_lists ) - 1, dtype = ny.intp )
+
+			data_order[ordered] = self._dict_order(
+				self._insertion_order( pair, targets, len( ordered ), num_classes ), target_ids[:len( ordered )]
+			)
+			class_order[ordered] = self._dict_order( self._insertion_order(
+				pair * self.num_values + values, targets, len( ordered ) * self.num_values, num_classes
+			), target_ids ).reshape( len( ordered ), self.num_values, num_classes )
+			value_order[ordered] = self._dict_order(
+				self._insertion_order( pair, values, len( ordered ), self.num_values ),
+				self.label_ids[features[ordered]]
+			)
+
+		data_entropy, totals = self._sequential_entropy( class_counts, data_order )
+		value_entropy, value_counts = self._sequential_entropy(
+			counts.reshape( -1, num_classes ), class_order.reshape( -1, num_classes )
+		)
+
+		val_prob = value_counts.reshape( num_pairs, self.num_values ) / totals[:, ny.newaxis]
+		terms = val_prob * value_entropy.reshape( num_pairs, self.num_values )
+
+		return data_entropy - self._ordered_sum( terms, value_order )
+
+
+	def _sequential_entropy( self, counts, order ):
+		""" Calculate the entropy of each row of class counts like the original builder.
+
+		counts -- Matrix with the class counts, one row per group.
+		order  -- Order in which the classes are summed.
+		Returns a tuple in the form: ( entropy of each group, number of rows in each group ).
+		"""
 
-		for attr in attributes:
-			gain = self._gain( data, attr, target_attr )
-			if gain >= best_gain and attr != target_attr:
-				best_gain = gain
-				best_attr = attr
+		totals = counts.sum( axis = 1 )
 
-		return best_attr
+		with ny.errstate( divide = "ignore", invalid = "ignore" ):
+			terms = -counts / totals[:, ny.newaxis] * ny.log2( counts / totals[:, ny.newaxis] )
+		terms[counts == 0] = 0.0
 
+		return self._ordered_sum( terms, order ), totals
 
-	def _get_values( self, data, attr ):
-		""" Creates a list of values in the given attribute for
-		each record in the data.
+
+	def _insertion_order( self, group, codes, num_groups, num_codes ):
+		""" Returns a matrix with the distinct codes of each group
+		in the order of their first appearance, filled up with -1.
 		"""
 
-		data = data[:]
-		lst = [record[attr] for record in data]
-		return list( set( lst ) )
+		distinct, first = ny.unique( group * num_codes + codes, return_index = True )
+		g, c = ny.divmod( distinct, num_codes )
+		order = ny.lexsort( ( first, g ) )
+		g, c = g[order], c[order]
+
+		result = ny.full( ( num_groups, num_codes ), -1, dtype = ny.intp )
+		result[g, ny.arange( len( g ) ) - ny.searchsorted( g, g )] = c
+
+		return result
 
 
-	def _get_examples( self, data, attr, value ):
-		""" Returns a list of all the records in <data> with
-		the value of <attr> matching the given value.
+	def _dict_order( self, insertion, label_ids ):
+		""" Returns the codes in the order a dict iterates over their labels,
+		if the labels were inserted in the given order.
+
+		insertion -- Matrix with the codes in the order of insertion, filled up with -1.
+		label_ids -- Index in label_lists of the labels of each row.
 		"""
 
-		data = data[:]
-		lst = []
+		# There are only few different rows. Each one is emulated with a dict once.
+		keys = ny.column_stack( ( label_ids, insertion + 1 ) )
+		base = keys.shape[1]
+		if len( self.label_lists ) * base ** base < 2 ** 62:
+			# One row as digits of a number is faster to compare.
+			packed = ny.dot( keys, base ** ny.arange( base - 1, -1, -1 ) )
+			first, inverse = ny.unique( packed, return_index = True, return_inverse = True )[1:]
+		else:
+			first, inverse = ny.unique( keys, axis = 0, return_index = True, return_inverse = True )[1:]
 
-		while len( data ) > 0:
-			record = data.pop()
-			if record[attr] == value:
-				lst.append( record )
+		result = ny.full( ( len( first ), insertion.shape[1] ), -1, dtype = ny.intp )
+		for i, row in enumerate( keys[first].tolist() ):
+			labels = self.label_lists[row[0]]
+			order = {}
+			for code in row[1:]:
+				if code > 0:
+					order[labels[code - 1]] = code - 1
+			result[i, :len( order )] = order.values()
+
+		return result[inverse.ravel()]
+
+
+	def _ordered_sum( self, terms, order ):
+		""" Sum each row of terms from left to right in the given order of columns.
+		Columns of -1 in the order are left out.
+		"""
 
-		return lst
+		total = ny.zeros( len( terms ) )
+		rows = ny.arange( len( terms ) )
 
+		for j in range( order.shape[1] ):
+			present = order[:, j] >= 0
+			total[present] += terms[rows[present], order[present, j]]
 
-	def _entropy( self, data, target_attr ):
-		""" Calculate the entropy of the given data for the target attribute. """
+		return total
 
-		val_freq = {}
-		data_entropy = 0.0
 
-		for record in data:
-			key = record[target_attr]
-			if val_freq.has_key( key ):
-				val_freq[key] += 1.0
+	def compile( self ):
+		""" Convert the tree into flat arrays for batched classification.
+		Only the inner nodes are stored. A reference to a node is its index,
+		a reference to a leaf is -1 - index of its outcome in leaf_labels.
+
+		root     -- Reference to the root.
+		feature  -- Column of the attribute to split on for each node.
+		children -- Reference to the next node for each value code. The last
+		            column is for values not in the tree and leads to "unknown".
+		"""
+
+		# Codes of the values, extended by values only known to an imported tree.
+		value_codes = [dict( ( label, code ) for code, label in enumerate( labels ) ) for labels in self.labels]
+		leaf_labels = list( self.target_labels ) + ["unknown"]
+
+		feature, branches = [], []
+		pending = [( None, None, self.tree )]
+
+		for parent, code, tree in pending:
+			attr = tree.keys()[0] if isinstance( tree, dict ) else None
+			if attr in self.features:
+				ref = len( feature )
+				f = self.features.index( attr )
+				feature.append( f )
+				for value, subtree in tree[attr].items():
+					pending.append( ( ref, value_codes[f].setdefault( value, len( value_codes[f] ) ), subtree ) )
 			else:
-				val_freq[key] = 1.0
+				if isinstance( tree, dict ):
+					# Split on an attribute unknown to this tree
+					tree = "unknown"
+				if tree not in leaf_labels:
+					leaf_labels.append( tree )
+				ref = -1 - leaf_labels.index( tree )
+			branches.append( ( parent, code, ref ) )
+
+		width = max( [len( codes ) for codes in value_codes] + [0] ) + 1
+		children = ny.full( ( len( feature ), width ), -1 - leaf_labels.index( "unknown" ), dtype = ny.intp )
+		for parent, code, ref in branches[1:]:
+			children[parent, code] = ref
+
+		self._use_compiled(
+			branches[0][2], ny.array( feature, dtype = ny.intp ), children, leaf_labels,
+			[sorted( codes, key = codes.get ) for codes in value_codes]
+		)
+
+
+	def _use_compiled( self, root, feature, children, leaf_labels, values ):
+		""" Classify with the given flat arrays of compile().
+
+		leaf_labels -- Outcome of each leaf.
+		values      -- Labels of the value codes for each attribute.
+		"""
 
-		for freq in val_freq.values():
-			data_entropy += -freq / len( data ) * ny.log2( freq / len( data ) )
+		value_codes = [dict( ( label, code ) for code, label in enumerate( labels ) ) for labels in values]
 
-		return data_entropy
+		# Code for every stone value in every attribute, for boards as matrix of stone values.
+		stones = ny.full( ( len( self.features ), len( STONE_LABELS ) ), -1, dtype = ny.intp )
+		for label, stone in STONE_LABELS.items():
+			for f, codes in enumerate( value_codes ):
+				stones[f, int( stone ) + 1] = codes.get( label, -1 )
 
+		self._compiled = ( root, feature, children, ny.array( leaf_labels, dtype = object ), value_codes, stones )
 
-	def _gain( self, data, attr, target_attr ):
-		""" Calculate the information gain (reduction in entropy) that would
-		result by splitting the data on the given attribute.
+
+	def _classify( self, codes ):
+		""" Classify rows of value codes with the compiled tree.
+		All rows descend one level at a time.
+
+		codes -- Matrix with the value code of every attribute, -1 for values not in the tree.
+		Returns the outcome for every row.
 		"""
 
-		val_freq = {}
-		subset_entropy = 0.0
+		if self._compiled is None:
+			self.compile()
+		root, feature, children, leaf_labels = self._compiled[:4]
 
-		for record in data:
-			key = record[attr]
-			if val_freq.has_key( key ):
-				val_freq[key] += 1.0
-			else:
-				val_freq[key] = 1.0
+		ref = ny.full( len( codes ), root, dtype = ny.intp )
+		active = ny.flatnonzero( ref >= 0 )
+
+		while len( active ) > 0:
+			node = ref[active]
+			ref[active] = children[node, codes[active, feature[node]]]
+			active = active[ref[active] >= 0]
 
-		for val in val_freq.keys():
-			val_prob = val_freq[val] / ny.sum( val_freq.values() )
-			data_subset = [record for record in data if record[attr] == val]
-			subset_entropy += val_prob * self._entropy( data_subset, target_attr )
+		return leaf_labels[-1 - ref]
 
-		return self._entropy( data, target_attr ) - subset_entropy
 
+	def predict_batch( self, boards ):
+		""" Return a classification for every board.
 
-	def use( self, record, tree = None ):
+		boards -- Matrix with one board per row in the array format for the AI, the cells hold the stone values.
+		Returns an array with the outcome for every board, "unknown" for boards the tree has no branch for.
+		"""
+
+		if self._compiled is None:
+			self.compile()
+		stones = self._compiled[5]
+
+		return self._classify( stones[ny.arange( len( self.features ) ), ny.asarray( boards, dtype = ny.intp ) + 1] )
+
+
+	def use( self, record ):
 		""" Return a classification for the given record. """
 
-		if tree is None:
-			tree = self.tree
+		return self.use_batch( [[record.get( attr ) for attr in self.features]], self.features )[0]
+
+
+	def use_batch( self, rows, attributes ):
+		""" Return a classification for every row of attribute values.
+
+		rows       -- Sequence of rows, each one a sequence of attribute values.
+		attributes -- Names of the attributes in the order of the row values.
+		"""
+
+		if self._compiled is None:
+			self.compile()
+		value_codes = self._compiled[4]
+
+		index = dict( zip( attributes, range( len( attributes ) ) ) )
+		codes = ny.full( ( len( rows ), len( self.features ) ), -1, dtype = ny.intp )
+
+		for f, attr in enumerate( self.features ):
+			if attr in index:
+				i = index[attr]
+				codes[:, f] = [value_codes[f].get( row[i], -1 ) for row in rows]
+
+		return self._classify( codes ).tolist()
+
 
-		if type( tree ) == type( "string" ):
-			return tree
+	def prune( self, codes, targets, rows = None ):
+		""" Reduced-error pruning: Every node is turned into a leaf with the most
+		frequent outcome of its training rows, if that does not classify more of
+		the held out rows wrong than the subtree does. The nodes are visited bottom-up.
+
+		codes   -- Matrix with the value codes of the held out rows, like the training data.
+		targets -- Outcome code of each held out row.
+		rows    -- Rows of the training data the tree was built from. Default: all
+		Returns a tuple in the form: ( stats() before, stats() after ), both with the accuracy on the held out rows.
+		"""
+
+		if rows is None:
+			rows = ny.arange( len( self.targets ) )
+
+		if self._compiled is None:
+			self.compile()
+		before = self.stats()
+		before["accuracy"] = self._accuracy( codes, targets )
+
+		train_counts = self._route( self.codes[rows], self.targets[rows] )[0]
+		valid_counts, subtree_errors = self._route( codes, targets )
+		majority = train_counts.argmax( axis = 1 )
+		leaf_errors = valid_counts.sum( axis = 1 ) - valid_counts[ny.arange( len( majority ) ), majority]
+
+		# Children have higher numbers than their parents.
+		children = self._compiled[2]
+		inner = children >= 0
+		parent = ny.full( len( children ), -1, dtype = ny.intp )
+		parent[children[inner]] = ny.nonzero( inner )[0]
+
+		leaves = {}
+		subtree_errors = subtree_errors.tolist()
+		for node in range( len( children ) - 1, -1, -1 ):
+			if leaf_errors[node] <= subtree_errors[node]:
+				leaves[node] = self.target_labels[majority[node]]
+				subtree_errors[node] = leaf_errors[node]
+			if parent[node] >= 0:
+				subtree_errors[parent[node]] += subtree_errors[node]
+
+		self.decompile( leaves )
+		self.compile()
+		after = self.stats()
+		after["accuracy"] = self._accuracy( codes, targets )
+
+		return before, after
+
+
+	def _route( self, codes, targets ):
+		""" Send rows through the compiled tree.
+
+		codes   -- Matrix with the value code of every attribute.
+		targets -- Outcome code of each row.
+		Returns a tuple in the form: ( class counts of the rows passing each node,
+		number of rows classified wrong by the leaves directly below each node ).
+		"""
 
-		attr = tree.keys()[0]
-		if attr not in record:
-			return "unknown"
-		if record[attr] not in tree[attr]:
-			return "unknown"
-		t = tree[attr][record[attr]]
+		root, feature, children, leaf_labels = self._compiled[:4]
+		num_nodes = len( feature )
+		num_classes = len( self.target_labels )
+		leaf_of_target = ny.array( [list( leaf_labels ).index( label ) for label in self.target_labels] )
 
-		return self.use( record, t )
+		counts = ny.zeros( num_nodes * num_classes, dtype = ny.intp )
+		errors = ny.zeros( num_nodes, dtype = ny.intp )
+
+		ref = ny.full( len( codes ), root, dtype = ny.intp )
+		active = ny.flatnonzero( ref >= 0 )
+
+		while len( active ) > 0:
+			node = ref[active]
+			counts += ny.bincount( node * num_classes + targets[active], minlength = len( counts ) )
+			ref[active] = children[node, codes[active, feature[node]]]
+			leaf = ref[active] < 0
+			wrong = leaf & ( -1 - ref[active] != leaf_of_target[targets[active]] )
+			errors += ny.bincount( node[wrong], minlength = num_nodes )
+			active = active[~leaf]
+
+		return counts.reshape( num_nodes, num_classes ), errors
+
+
+	def _accuracy( self, codes, targets ):
+		""" Returns the fraction of rows classified correctly. """
+
+		if len( targets ) == 0:
+			return 0.0
+
+		outcomes = self._classify( codes )
+
+		return ( outcomes == ny.array( self.target_labels, dtype = object )[targets] ).mean()
+
+
+	def stats( self ):
+		""" Returns the size of the compiled tree as dict with the number
+		of nodes (inner nodes and leaves), the leaves and the depth.
+		"""
+
+		if self._compiled is None:
+			self.compile()
+		root, feature, children, leaf_labels = self._compiled[:4]
+
+		unknown = -1 - list( leaf_labels ).index( "unknown" )
+		leaves = int( ( ( children < 0 ) & ( children != unknown ) ).sum() ) + int( root < 0 )
+
+		depth = 0
+		level = ny.array( [root] )
+		while len( level ) > 0 and level[0] >= 0:
+			depth += 1
+			level = children[level].ravel()
+			level = level[level >= 0]
+
+		return { "nodes": len( feature ) + leaves, "leaves": leaves, "depth": depth }
+
+
+	def decompile( self, leaves = None ):
+		""" Rebuild the nested dict tree from the flat arrays, e.g. after a binary import.
+
+		leaves -- Dict of inner nodes to replace by leaves with the given outcome.
+		"""
+
+		leaves = leaves or {}
+		root, feature, children, leaf_labels, value_codes = self._compiled[:5]
+		values = [dict( ( code, label ) for label, code in codes.items() ) for codes in value_codes]
+		unknown = -1 - list( leaf_labels ).index( "unknown" )
+
+		tree = {}
+		pending = [( tree, None, root )]
+		for parent, key, ref in pending:
+			if ref < 0:
+				parent[key] = leaf_labels[-1 - ref]
+				continue
+			if ref in leaves:
+				parent[key] = leaves[ref]
+				continue
+			f = feature[ref]
+			branches = {}
+			parent[key] = { self.features[f]: branches }
+			for code in ny.flatnonzero( children[ref, :-1] != unknown ):
+				pending.append( ( branches, values[f][code], children[ref, code] ) )
+
+		self.tree = tree[None]
 
 
 	def export( self, filename = DT_EXPORT_FILE ):
-		""" Export a created decision tree. """
+		""" Export a created decision tree in the binary format.
+		The file holds the flat arrays of compile() in the smallest integer
+		types and the names of the attributes and labels of the values and outcomes.
+		"""
+
+		if self._compiled is None:
+			self.compile()
+		root, feature, children, leaf_labels, value_codes = self._compiled[:5]
+
+		meta = {
+			"attributes": self.attributes,
+			"target_attr": self.target_attr,
+			"features": self.features,
+			"values": [sorted( codes, key = codes.get ) for codes in value_codes],
+			"leaf_labels": leaf_labels.tolist(),
+			"root": int( root )
+		}
+		binfile.write( filename, EXPORT_MAGIC, EXPORT_VERSION, meta, [
+			( "feature", _smallest_int( feature ) ),
+			( "children", _smallest_int( children ) )
+		] )
+
+
+	def export_txt( self, filename = DT_EXPORT_FILE_TXT ):
+		""" Export a created decision tree as Python literal. """
+
+		if self.tree is None and self._compiled is not None:
+			self.decompile()
 
 		f = open( filename, "w" )
 		f.write( str( self.tree ) )
@@ -193,19 +849,90 @@ class DTree:
 	def export_js( self, filename = DT_EXPORT_FILE_JS ):
 		""" Export a created decision tree as Javascript file. """
 
+		if self.tree is None and self._compiled is not None:
+			self.decompile()
+
 		f = open( filename, "w" )
 		f.write( "var DTree_tree = " + str( self.tree ) + ";" )
 		f.close()
 
 
 	def import_ai( self, filename = DT_EXPORT_FILE ):
-		""" Import a previously created decision tree. """
+		""" Import a previously created decision tree.
+		Binary files are memory-mapped, the nested dict tree is only rebuilt
+		if needed. Files in the text format are parsed.
+		"""
 
-		f = open( filename, "r" )
-		self.tree = ast.literal_eval( f.read() )
-		f.close()
+		if binfile.is_binfile( filename, EXPORT_MAGIC ):
+			version, meta, arrays = binfile.read( filename, EXPORT_MAGIC )
+			if version > EXPORT_VERSION:
+				raise ValueError( "%s has the unknown version %d." % ( filename, version ) )
+
+			self.features = _plain( meta["features"] )
+			self.tree = None
+			self._use_compiled(
+				meta["root"], arrays["feature"], arrays["children"],
+				_plain( meta["leaf_labels"] ), _plain( meta["values"] )
+			)
+		else:
+			f = open( filename, "r" )
+			self.tree = ast.literal_eval( f.read() )
+			self._compiled = None
+			f.close()
+
+
+def _plain( value ):
+	""" Turn the unicode strings read from JSON back into normal strings. """
+
+	if isinstance( value, list ):
+		return [_plain( v ) for v in value]
+	if isinstance( value, unicode ):
+		return str( value )
+
+	return value
+
+
+def _smallest_int( a ):
+	""" Returns the array in the smallest signed integer type holding its values. """
+
+	for dtype in ( ny.int8, ny.int16, ny.int32 ):
+		if a.size == 0 or ( a.min() >= ny.iinfo( dtype ).min and a.max() <= ny.iinfo( dtype ).max ):
+			return a.astype( dtype )
+
+	return a
+
+
+def convert( file_in = DT_EXPORT_FILE_TXT, file_out = DT_EXPORT_FILE,
+		attributes = DATA_ATTRIBUTES, target_attr = DT_TARGET_ATTRIBUTE ):
+	""" Convert a decision tree exported in the text format into the binary format. """
+
+	dt = DTree( [], attributes, target_attr )
+	dt.import_ai( file_in )
+	dt.export( file_out )
+
+
+
+# Data of the worker processes building subtrees
+_worker = {}
+
+
+def _init_worker( tree, filename ):
+	""" Initialise a worker process with the tree and the memory-mapped training data. """
+
+	version, meta, arrays = binfile.read( filename, SHARED_MAGIC )
+	tree.codes, tree.targets = arrays["codes"], arrays["targets"]
+	_worker["tree"] = tree
+
+
+def _make_tree_worker( task ):
+	""" Build one subtree in a worker process.
+
+	task -- Tuple in the form: ( rows, used attributes, depth ).
+	"""
 
+	rows, used, depth = task
 
+	return _worker["tree"]._make_tree( rows, used, depth )
 
 
 
@@ -236,7 +963,7 @@ if __name__ == "__main__":
 		else: print "  False: %s == %s" % ( out[i], targets[i] )
 	print "Correct: %d/%d" % ( correct, len( targets ) )
 
-	export_file = "exports/export_dtree_xor.txt"
+	export_file = "exports/export_dtree_xor.bin"
 	my_dtree.export( export_file )
 	print "Tree exported to %s." % export_file
 	my_dtree.import_ai( export_file )
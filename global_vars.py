@@ -5,11 +5,21 @@ VERBOSE = True
 
 # File name with training data
 FILE_DATA = "connect-4.data"
+# Extension of the binary cache next to each file with training data, created on first import
+FILE_DATA_CACHE_EXT = ".cache"
 # Number of attributes in each line
 DATA_NUM_ATTR = 43
 
 DATA_LIMIT = 67557 # Limit data to use for training (67557 in total)
+DATA_CHUNK_SIZE = 4096 # Boards per chunk when streaming the training data
+DATA_STREAM_VALID = 0.1 # Fraction of the boards kept for validation when streaming the training data
 DATA_NORMALIZE = False
+DTYPE = "float32" # Floating point type of data and weights: "float32" or "float64"
+SEED = 0 # Seed for shuffling the data and training, None for a random one
+
+# Store of trained models
+STORE_DIR = "exports/store"
+STORE_MAX_SIZE = 64 << 20 # Bytes, the least recently used models are removed
 
 # Game board
 FIELD_WIDTH = 7
@@ -26,35 +36,84 @@ WIN = 0.0
 DRAW = 0.5
 LOSS = 1.0
 
+# Labels in the training data
+STONE_LABELS = { "x": STONE_HUMAN, "o": STONE_AI, "b": STONE_BLANK }
+OUTCOMES = ["win", "draw", "loss"] # Index is the outcome code
+OUTCOME_TARGETS = [WIN, DRAW, LOSS]
+
 # Config MLP
+MLP_BATCH_SIZE = 0 # Samples per weight update, 0 for full batch
 MLP_BETA = 1.0
+MLP_CHECKPOINT_EVERY = 5 # Rounds of early stopping between two checkpoints
+MLP_CHECKPOINT_FILE = "exports/checkpoint_mlp.bin" # None for no checkpoints
 MLP_ES_DIFF = 1 # Error difference in early stopping
 MLP_ES_MAX_ITER = 240
 MLP_ETA = 0.35
-MLP_EXPORT_FILE = "exports/export_mlp.txt"
+MLP_EXPORT_FILE = "exports/export_mlp.bin"
 MLP_EXPORT_FILE_JS = "web/export_mlp.js"
+MLP_EXPORT_FILE_TXT = "exports/export_mlp.txt"
 MLP_HIDDEN_NODES = 40
 MLP_ITER = 40
 MLP_MOMENTUM = 0.7
 MLP_OUTTYPE = "linear"
 
 # Config RBF
+RBF_CHUNK_SIZE = 8192 # Rows processed at once in k-means and the hidden layer
 RBF_ETA = 0.4
-RBF_EXPORT_FILE = "exports/export_rbf.txt"
+RBF_EXPORT_FILE = "exports/export_rbf.bin"
 RBF_EXPORT_FILE_JS = "web/export_rbf.js"
+RBF_EXPORT_FILE_TXT = "exports/export_rbf.txt"
 RBF_ITER = 40
 RBF_KMEANS = True
+RBF_KMEANS_BATCH = 0 # Rows per mini-batch in k-means, 0 for full batch
+RBF_KMEANS_INIT = "k-means++" # Seeding of k-means: "k-means++" or "uniform"
+RBF_KMEANS_ITER = 100
+RBF_KMEANS_N_INIT = 1 # Runs of k-means with different seeds, run in parallel processes
 RBF_NODES = 30
 RBF_NORMALIZE = True
+RBF_RIDGE = 0.001 # Regularisation of the "lstsq" solver
 RBF_SIGMA = 0
+RBF_SOLVER = "perceptron" # Output layer: "perceptron" (trained) or "lstsq" (least squares)
 
 # Config DTree
-DT_EXPORT_FILE = "exports/export_dtree.txt"
+DT_COUNT_LIMIT = 1 << 22 # Cells of the contingency table counted at once while building
+DT_EXPORT_FILE = "exports/export_dtree.bin"
 DT_EXPORT_FILE_JS = "web/export_dtree.js"
+DT_EXPORT_FILE_TXT = "exports/export_dtree.txt"
+DT_MAX_DEPTH = 0 # Nodes at this depth become leaves, 0 for no limit
+DT_MIN_GAIN = 0.0 # Nodes are only split with at least this information gain
+DT_MIN_SAMPLES = 2 # Nodes with less rows become leaves
+DT_PARALLEL_MIN_SIZE = 2000 # Subtrees with at least this many rows are built in worker processes
+DT_PRUNE_FRACTION = 0.0 # Training data held out for reduced-error pruning, 0 for no pruning
 DT_TARGET_ATTRIBUTE = "outcome"
+DT_WORKERS = 0 # Worker processes for building the tree, 0 for one per CPU, 1 for none
 DATA_ATTRIBUTES = [
 	"a1","a2","a3","a4","a5","a6","b1","b2","b3","b4","b5","b6",
 	"c1","c2","c3","c4","c5","c6","d1","d2","d3","d4","d5","d6",
 	"e1","e2","e3","e4","e5","e6","f1","f2","f3","f4","f5","f6",
 	"g1","g2","g3","g4","g5","g6", DT_TARGET_ATTRIBUTE
-]
\ No newline at end of file
+]
+
+# Config hyperparameter sweep
+SWEEP_MAX_ROUNDS = 27 # Rounds of training in the last rung of successive halving
+SWEEP_MIN_ROUNDS = 1 # Rounds of training in the first rung
+SWEEP_REDUCTION = 3 # The best 1/3 of the trials continue with 3 times as many rounds
+SWEEP_RESULTS_FILE = "exports/sweep_%s.txt" # With the AI type in lower case
+SWEEP_SPACES = {
+	"MLP": {
+		"MLP_BETA": [0.5, 1.0],
+		"MLP_ETA": [0.1, 0.2, 0.35],
+		"MLP_HIDDEN_NODES": [20, 30, 40, 60],
+		"MLP_MOMENTUM": [0.5, 0.7, 0.9]
+	},
+	"RBF": {
+		"RBF_NODES": [20, 30, 50, 80],
+		"RBF_SIGMA": [0, 0.5, 1.0, 2.0]
+	}
+}
+SWEEP_VALID_FRACTION = 0.25 # Data only used to compare the trials
+SWEEP_WORKERS = 0 # Worker processes for the trials, 0 for one per CPU
+
+# Config cross-validation
+CROSSVAL_FOLDS = 5
+CROSSVAL_WORKERS = 0 # Worker processes for the folds, 0 for one per CPU
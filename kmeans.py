@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 
 from global_vars import *
-import numpy as ny
+import multiprocessing, numpy as ny
 
 
 class kmeans:
@@ -11,77 +11,250 @@ class kmeans:
 	(http://seat.massey.ac.nz/personal/s.r.marsland/MLBook.html)
 	"""
 
-	def __init__( self, k ):
+	def __init__( self, k, chunk_size = RBF_CHUNK_SIZE, init = "k-means++", n_init = 1,
+			batch_size = 0, processes = 0 ):
 		""" Constructor.
 
-		k    -- Expected number of classes/cluster centres.
+		k          -- Expected number of classes/cluster centres.
+		chunk_size -- Number of rows processed at once. Limits the size of temporary arrays.
+		init       -- Seeding of the centres: "k-means++" or "uniform" (inside the range of each feature).
+		n_init     -- Number of runs with different seeds. The result with the lowest inertia is kept.
+		batch_size -- Rows per mini-batch. 0 to use all data in every iteration.
+		processes  -- Worker processes for the runs if n_init > 1. 0 for one per CPU.
 		"""
 
 		self.k = k
+		self.chunk_size = chunk_size
+		self.init = init
+		self.n_init = n_init
+		self.batch_size = batch_size
+		self.processes = processes
 
 
-	def train( self, data, iter_limit = 10 ):
+	def train( self, data, iter_limit = 10, tol = 0.0 ):
 		""" Train.
 
 		data       -- Input data to train with.
-		iter_limit -- Maximum number of iterations. Default: 10
+		iter_limit -- Maximum number of iterations. With mini-batches one
+		              iteration is as many batches as there are rows in data. Default: 10
+		tol        -- Stop if no centre moved further than this distance. Default: 0.0
+		              With mini-batches the centres move a little in every pass, only tol > 0 stops early.
 		Returns the cluster centres.
 		"""
 
-		self.data = data
+		self.iter_limit = iter_limit
+		self.tol = tol
+		seeds = ny.random.randint( 2 ** 31 - 1, size = max( self.n_init, 1 ) )
+
+		if len( seeds ) == 1:
+			results = [self._run( data, ny.random.RandomState( seeds[0] ) )]
+		else:
+			pool = multiprocessing.Pool( self.processes or None, _init_worker, ( self, data ) )
+			try:
+				results = pool.map( _run_worker, seeds )
+			finally:
+				pool.close()
+				pool.join()
+
+		self.centres, self.inertia = min( results, key = lambda result: result[1] )
+
+		return self.centres
+
+
+	def _run( self, data, rng ):
+		""" One run of k-means.
+
+		data -- Input data to train with.
+		rng  -- Random number generator for seeding and mini-batches.
+		Returns a tuple in the form: ( centres, inertia ).
+		"""
+
 		self.data_amount = len( data )
 		self.data_dim = len( data[0] )
 
+		if self.init == "k-means++":
+			self.centres = self._seed_plusplus( data, rng )
+		else:
+			self.centres = self._seed_uniform( data, rng )
+
+		# Rows assigned to each centre over all mini-batches of the run
+		seen = ny.zeros( self.k )
+
+		count = 0
+		while count < self.iter_limit:
+			count += 1
+
+			if self.batch_size > 0:
+				moved = self._minibatch_pass( data, rng, seen )
+			else:
+				cluster, inertia = self._forward( data )
+				moved = self._update( data, cluster )
+
+			if moved <= self.tol:
+				break
+
+		cluster, inertia = self._forward( data )
+
+		return self.centres, inertia
+
+
+	def _seed_uniform( self, data, rng ):
+		""" Returns centres placed randomly inside the range of each feature. """
+
 		# Minimum and maximum for each feature.
 		minima = data.min( axis = 0 )
 		maxima = data.max( axis = 0 )
 
-		# Centers
-		self.centres = ny.random.rand( self.k, self.data_dim ) * ( maxima - minima ) + minima
-		centres_old = ny.random.rand( self.k, self.data_dim ) * ( maxima - minima ) + minima
+		return ( rng.rand( self.k, self.data_dim ) * ( maxima - minima ) + minima ).astype( data.dtype )
 
-		count = 0
-		while ny.sum( ny.sum( centres_old - self.centres ) ) != 0 and count < iter_limit:
-			centres_old = self.centres.copy()
-			count += 1
 
-			cluster = self._forward( data )
-			self._update( cluster )
+	def _seed_plusplus( self, data, rng ):
+		""" k-means++ seeding: Returns centres chosen from the data. Every further
+		centre is chosen with a probability proportional to the squared
+		distance to the closest centre chosen so far.
+		"""
 
-		return self.centres
+		centres = ny.empty( ( self.k, self.data_dim ), dtype = data.dtype )
+		centres[0] = data[rng.randint( self.data_amount )]
+		closest = self._square_distances( data, centres[0] )
+
+		for i in range( 1, self.k ):
+			cumulative = ny.cumsum( closest )
+			if cumulative[-1] > 0:
+				index = ny.searchsorted( cumulative, rng.random_sample() * cumulative[-1], side = "right" )
+			else:
+				# Less distinct rows than centres
+				index = rng.randint( self.data_amount )
+			centres[i] = data[min( index, self.data_amount - 1 )]
+			ny.minimum( closest, self._square_distances( data, centres[i] ), out = closest )
+
+		return centres
+
+
+	def _square_distances( self, data, centre ):
+		""" Returns the squared distance of each row of data to one centre. """
+
+		dist = ny.empty( len( data ) )
+		for start, chunk in self._chunks( data ):
+			dist[start:start + len( chunk )] = ( ( chunk - centre ) ** 2 ).sum( axis = 1 )
+
+		return dist
+
+
+	def _chunks( self, data ):
+		""" Yields tuples in the form: ( start index, chunk of data ). """
+
+		for start in range( 0, len( data ), self.chunk_size ):
+			yield start, data[start:start + self.chunk_size]
 
 
 	def _forward( self, data ):
 		""" Run forward.
 
-		Returns the closest cluster.
+		Returns a tuple in the form: ( index of the closest cluster centre for each
+		row of data, inertia ). The inertia is the sum of squared distances to the closest centres.
+		"""
+
+		cluster = ny.empty( len( data ), dtype = ny.intp )
+		inertia = 0.0
+
+		# Squared distance |x - c|^2 = |x|^2 - 2 x.c + |c|^2.
+		# |x|^2 is the same for every centre and only added for the inertia.
+		centres_square = ( self.centres ** 2 ).sum( axis = 1 )
+
+		for start, chunk in self._chunks( data ):
+			dist = ny.dot( chunk, ny.transpose( self.centres ) )
+			dist *= -2.0
+			dist += centres_square
+			closest = dist.argmin( axis = 1 )
+			cluster[start:start + len( chunk )] = closest
+			inertia += dist[ny.arange( len( chunk ) ), closest].sum() + ( chunk.astype( ny.float64 ) ** 2 ).sum()
+
+		return cluster, inertia
+
+
+	def _cluster_sums( self, data, cluster ):
+		""" Returns the sum of the data and the number of rows for each cluster. """
+
+		counts = ny.bincount( cluster, minlength = self.k )
+		sums = ny.zeros( ( self.k, self.data_dim ) )
+		features = ny.arange( self.data_dim )
+
+		# One bincount over the flat index ( cluster, feature ) for each chunk.
+		for start, chunk in self._chunks( data ):
+			index = cluster[start:start + len( chunk ), ny.newaxis] * self.data_dim + features
+			sums += ny.bincount(
+				index.ravel(), weights = ny.ravel( chunk ), minlength = self.k * self.data_dim
+			).reshape( self.k, self.data_dim )
+
+		return sums, counts
+
+
+	def _move( self, centres, used ):
+		""" Move the used centres to new positions.
+		Returns the largest distance a centre moved.
 		"""
 
-		ones_data = ny.ones( ( 1, self.data_amount ) )
+		moved = ny.sqrt( ( ( centres - self.centres[used] ) ** 2 ).sum( axis = 1 ) )
+		self.centres[used] = centres
 
-		# Distance between input data and current cluster centres.
-		dist = ones_data * ny.sum( ( data - self.centres[0,:] ) ** 2, axis = 1 )
-		for i in range( self.k - 1 ):
-			sum_square = ny.sum( ( data - self.centres[i + 1,:] ) ** 2, axis = 1 )
-			dist = ny.append( dist, ones_data * sum_square, axis = 0 )
+		return moved.max() if len( moved ) else 0.0
 
-		# Find closest cluster
-		cluster = dist.argmin( axis = 0 )
-		cluster = ny.transpose( cluster * ones_data )
 
-		return cluster
+	def _update( self, data, cluster ):
+		""" Update cluster centres. Centres without data keep their position.
+
+		data    -- Input data.
+		cluster -- Index of the closest cluster centre for each row of data.
+		Returns the largest distance a centre moved.
+		"""
+
+		sums, counts = self._cluster_sums( data, cluster )
+		used = counts > 0
+
+		return self._move( sums[used] / counts[used, ny.newaxis], used )
 
 
-	def _update( self, cluster ):
-		""" Update cluster centres.
+	def _minibatch_pass( self, data, rng, seen ):
+		""" Mini-batch k-means: Update the centres with random batches until as many
+		rows as there are in data have been used. Each centre is the running mean of
+		all rows assigned to it so far in the run, so its steps get smaller with every pass.
 
-		cluster -- The clusters.
+		data -- Input data.
+		rng  -- Random number generator for the batches.
+		seen -- Number of rows assigned to each centre in the previous passes. Updated in place.
+		Returns the largest distance a centre moved in this pass.
 		"""
 
-		for i in range( self.k ):
-			cluster_i = ny.where( cluster == i, 1, 0 )
+		start_centres = self.centres.copy()
+
+		for n in range( max( self.data_amount // self.batch_size, 1 ) ):
+			batch = data[ny.sort( rng.randint( self.data_amount, size = self.batch_size ) )]
+			cluster, inertia = self._forward( batch )
+			sums, counts = self._cluster_sums( batch, cluster )
+			used = counts > 0
+
+			# Running mean: c = ( seen * c + sum of new rows ) / ( seen + new rows )
+			seen[used] += counts[used]
+			rate = ( counts[used] / seen[used] )[:, ny.newaxis]
+			self.centres[used] += rate * ( sums[used] / counts[used, ny.newaxis] - self.centres[used] )
+
+		return ny.sqrt( ( ( self.centres - start_centres ) ** 2 ).sum( axis = 1 ) ).max()
+
+
+
+# Data of the worker processes for runs with different seeds
+_worker = {}
+
+
+def _init_worker( net, data ):
+	""" Initialise a worker process with the k-means instance and the data. """
+
+	_worker["net"] = net
+	_worker["data"] = data
+
+
+def _run_worker( seed ):
+	""" Do one run of k-means in a worker process. """
 
-			if ny.sum( cluster_i ) > 0:
-				cluster_data_sum = ny.sum( self.data * cluster_i, axis = 0 )
-				cluster_i_sum = ny.sum( cluster_i )
-				self.centres[i,:] = cluster_data_sum / cluster_i_sum
+	return _worker["net"]._run( _worker["data"], ny.random.RandomState( seed ) )
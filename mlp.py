@@ -2,7 +2,17 @@
 # -*- coding: utf-8 -*-
 
 from global_vars import *
-import numpy as ny
+import os, hashlib, numpy as ny
+import binfile
+
+
+# Binary export format
+EXPORT_MAGIC = "C4MLP\0\0\0"
+EXPORT_VERSION = 1
+
+# Checkpoints of early_stopping()
+CHECKPOINT_MAGIC = "C4MLPCKP"
+CHECKPOINT_VERSION = 2
 
 
 class MLP:
@@ -12,7 +22,7 @@ class MLP:
 	"""
 
 
-	def __init__( self, inputs, targets, hidden_nodes = 2, beta = 1, momentum = 0.9 ):
+	def __init__( self, inputs, targets, hidden_nodes = 2, beta = 1, momentum = 0.9, dtype = DTYPE ):
 		""" Constructor.
 
 		inputs       -- Array with training data.
@@ -20,23 +30,26 @@ class MLP:
 		hidden_nodes -- Number of nodes in the hidden layer.
 		beta         -- Some positiv parameter in the activation function.
 		momentum     -- Learning speed.
+		dtype        -- Floating point type of data and weights.
 		"""
 
-		self.inputs = ny.array( inputs )
-		self.targets = ny.array( targets )
+		self.dtype = ny.dtype( dtype )
+		self.inputs = ny.array( inputs, dtype = self.dtype )
+		self.targets = ny.array( targets, dtype = self.dtype )
 
 		self.nodes_in = len( inputs[0] )
 		self.nodes_out = len( targets[0] )
 		self.data_amount = len( inputs )
 
 		# Add bias node
-		ones = -ny.ones( ( self.data_amount, 1 ) )
+		ones = -ny.ones( ( self.data_amount, 1 ), dtype = self.dtype )
 		self.inputs = ny.concatenate( ( self.inputs, ones ), axis = 1 )
 
 		self.nodes_hidden = hidden_nodes
 		self.beta = beta
 		self.momentum = momentum
 		self.outtype = MLP_OUTTYPE
+		self._workspaces = {}
 
 		self._init_weights()
 
@@ -50,160 +63,432 @@ class MLP:
 
 		self.weights_layer1 = ny.random.rand(
 			self.nodes_in + 1, self.nodes_hidden
-		)
+		).astype( self.dtype )
 		self.weights_layer2 = ny.random.rand(
 			self.nodes_hidden + 1, self.nodes_out
-		)
+		).astype( self.dtype )
 
 		self.weights_layer1 -= 0.5
 		self.weights_layer2 -= 0.5
 		self.weights_layer1 *= 2.0 / ny.sqrt( self.nodes_in )
 		self.weights_layer2 *= 2.0 / ny.sqrt( self.nodes_hidden )
 
+		self._inference = None
 
-	def early_stopping( self, valid, validtargets, eta = 0.25, iterations = 1000, outtype = "logistic" ):
-		""" Early stopping. Used instead of method train().
 
-		valid        -- Validation data.
-		validtargets -- Target values to validation data.
-		eta          -- Learning rate.
-		iterations   -- Number of iterations to do.
-		outtype      -- Type of activation function.
+	def early_stopping( self, valid, validtargets, eta = 0.25, iterations = 1000, outtype = "logistic",
+			batch_size = 0, checkpoint = MLP_CHECKPOINT_FILE, checkpoint_every = MLP_CHECKPOINT_EVERY,
+			resume = False, seed = None, stream = None ):
+		""" Early stopping. Used instead of method train().
+		When training ends, the weights with the lowest validation error are restored.
+
+		valid            -- Validation data.
+		validtargets     -- Target values to validation data.
+		eta              -- Learning rate.
+		iterations       -- Number of iterations to do.
+		outtype          -- Type of activation function.
+		batch_size       -- Samples per weight update. 0 for full batch.
+		checkpoint       -- File for checkpoints of the training progress. None for no checkpoints.
+		checkpoint_every -- Write a checkpoint after this many rounds of training.
+		resume           -- Continue from the checkpoint file. Only a checkpoint written with the
+		                    same settings, data and seed is resumed, otherwise or without a
+		                    checkpoint a ValueError is raised.
+		seed             -- Seed of the random number generator the run was started with.
+		stream           -- Function returning the chunks of one pass over the training data, e.g. from
+		                    dataset.stream(). Each iteration is one pass with train_stream().
+		                    Default: None, train with the data of the constructor.
 		"""
 
 		# Add bias node
-		valid = ny.concatenate( ( valid, -ny.ones( ( len( valid ), 1 ) ) ), axis = 1 )
+		valid = ny.concatenate(
+			( ny.asarray( valid, dtype = self.dtype ), -ny.ones( ( len( valid ), 1 ), dtype = self.dtype ) ),
+			axis = 1
+		)
+
+		self.val_errors = []
+		self._best = ( ny.inf, self.weights_layer1.copy(), self.weights_layer2.copy() )
+
+		# Everything the course of the training depends on
+		run = {
+			"eta": float( eta ), "iterations": iterations, "outtype": outtype, "batch_size": batch_size,
+			"momentum": float( self.momentum ), "beta": float( self.beta ), "dtype": self.dtype.name,
+			"seed": seed, "stream": stream is not None, "data": self._checksum( valid, validtargets )
+		}
 
-		old_val_err1, old_val_err2, new_val_err = 100002, 100001, 100000
-		count = 0
+		if resume:
+			if not checkpoint or not os.path.exists( checkpoint ):
+				raise ValueError( "There is no checkpoint %s to resume from." % checkpoint )
+			self._load_checkpoint( checkpoint, run )
+			print "[early_stopping] Resumed from %s after %d rounds." % ( checkpoint, len( self.val_errors ) )
+
+		# Validation errors of the last three rounds
+		errors = [100001, 100002, 100000] + self.val_errors
+		old_val_err2, old_val_err1, new_val_err = errors[-3:]
+		count = len( self.val_errors )
 
 		while ( old_val_err1 - new_val_err > MLP_ES_DIFF ) or ( old_val_err2 - old_val_err1 > MLP_ES_DIFF ):
 			if count >= MLP_ES_MAX_ITER:
 				print "[early_stopping] Reached limit of %d iterations." % MLP_ES_MAX_ITER
 				break
 
-			self.train( eta, iterations, outtype )
+			if stream is None:
+				self.train( eta, iterations, outtype, batch_size )
+			else:
+				for n in range( iterations ):
+					self.train_stream( stream(), eta, outtype )
 			old_val_err2 = old_val_err1
 			old_val_err1 = new_val_err
 			validout = self._forward( valid )
-			new_val_err = 0.5 * ny.sum( ( validtargets - validout ) ** 2 )
+			new_val_err = float( 0.5 * ny.sum( ( validtargets - validout ) ** 2 ) )
+
+			self.val_errors.append( new_val_err )
+			if new_val_err < self._best[0]:
+				self._best = ( new_val_err, self.weights_layer1.copy(), self.weights_layer2.copy() )
 
 			count += 1
 			print "[early_stopping] count: %d   error: %f" % ( count, new_val_err )
+
+			if checkpoint and count % checkpoint_every == 0:
+				self._save_checkpoint( checkpoint, run )
 		print "[early_stopping] end count: %d and error: %f" % ( count, new_val_err )
 
+		if checkpoint and self.val_errors:
+			self._save_checkpoint( checkpoint, run )
+
+		if self._best[0] < new_val_err:
+			print "[early_stopping] Restored the weights of the lowest error: %f" % self._best[0]
+			self.weights_layer1 = self._best[1].astype( self.dtype )
+			self.weights_layer2 = self._best[2].astype( self.dtype )
+			self._inference = None
+
+
+	def _checksum( self, valid, validtargets ):
+		""" Returns the MD5 checksum of the training and validation data. """
+
+		md5 = hashlib.md5()
+		for a in ( self.inputs, self.targets, valid, validtargets ):
+			md5.update( ny.ascontiguousarray( a, dtype = self.dtype ).tostring() )
+
+		return md5.hexdigest()
+
 
-	def train( self, eta = 0.25, iterations = 1000, outtype = "logistic" ):
+	def _save_checkpoint( self, filename, run ):
+		""" Save the training progress of early_stopping(): Weights, the weights with the
+		lowest validation error, the state of the random number generator and the validation errors.
+		The weight updates are not saved, train() starts every round without them.
+
+		filename -- File of the checkpoint.
+		run      -- Dict of the settings, data checksum and seed of the run.
+		"""
+
+		rng_name, rng_keys, rng_pos, has_gauss, cached_gaussian = ny.random.get_state()
+		meta = {
+			"run": run,
+			"val_errors": self.val_errors,
+			"best_error": self._best[0],
+			"rng": [rng_name, rng_pos, has_gauss, cached_gaussian]
+		}
+		binfile.write( filename, CHECKPOINT_MAGIC, CHECKPOINT_VERSION, meta, [
+			( "weights_layer1", self.weights_layer1 ),
+			( "weights_layer2", self.weights_layer2 ),
+			( "best_w1", self._best[1] ),
+			( "best_w2", self._best[2] ),
+			( "rng_keys", rng_keys )
+		] )
+
+
+	def _load_checkpoint( self, filename, run ):
+		""" Restore the training progress saved by _save_checkpoint().
+		Raises a ValueError if the checkpoint belongs to another run.
+
+		filename -- File of the checkpoint.
+		run      -- Dict of the settings, data checksum and seed of the run to continue.
+		"""
+
+		version, meta, arrays = binfile.read( filename, CHECKPOINT_MAGIC, mmap = False )
+		if version != CHECKPOINT_VERSION:
+			raise ValueError( "%s has the unsupported version %d." % ( filename, version ) )
+
+		shapes = ( self.weights_layer1.shape, self.weights_layer2.shape )
+		if ( arrays["weights_layer1"].shape, arrays["weights_layer2"].shape ) != shapes:
+			raise ValueError( "%s does not fit a network with layers of %s and %s." % ( ( filename, ) + shapes ) )
+
+		different = sorted( name for name in run if meta["run"].get( name ) != run[name] )
+		if different:
+			raise ValueError( "%s was written by a run with other %s." % ( filename, ", ".join( different ) ) )
+
+		self.weights_layer1 = arrays["weights_layer1"].astype( self.dtype )
+		self.weights_layer2 = arrays["weights_layer2"].astype( self.dtype )
+		self._best = ( meta["best_error"], arrays["best_w1"], arrays["best_w2"] )
+		self.val_errors = meta["val_errors"]
+		self._inference = None
+
+		rng_name, rng_pos, has_gauss, cached_gaussian = meta["rng"]
+		ny.random.set_state( ( str( rng_name ), arrays["rng_keys"], rng_pos, has_gauss, cached_gaussian ) )
+
+
+	def train( self, eta = 0.25, iterations = 1000, outtype = "logistic", batch_size = 0 ):
 		""" Train the network. Used instead of method early_stopping().
 
 		eta        -- Learning rate.
-		iterations -- Number of iterations to do.
+		iterations -- Number of iterations to do. With mini-batches one
+		              iteration is one pass over all training data.
 		outtype    -- Activation function to use: "linear", "logistic"
+		batch_size -- Samples per weight update. 0 for full batch.
 		"""
 
 		self.eta = eta
 		self.outtype = outtype
-		shuffle = range( self.data_amount )
-
-		# Init arrays for weight updates
-		self.update_w1 = ny.zeros( ( ny.shape( self.weights_layer1 ) ) )
-		self.update_w2 = ny.zeros( ( ny.shape( self.weights_layer2 ) ) )
+		self._inference = None
+		self._init_updates()
 
 		# Start training
 		for n in range( iterations ):
-			self.outputs = self._forward( self.inputs )
+			if batch_size <= 0 or batch_size >= self.data_amount:
+				self._train_step( self.inputs, self.targets )
+				continue
+
+			# Mini-batches in random order of training data
+			order = ny.random.permutation( self.data_amount )
+			for start in range( 0, self.data_amount, batch_size ):
+				batch = order[start:start + batch_size]
+				ws = self._workspace( len( batch ) ).batch()
+				ny.take( self.inputs, batch, axis = 0, out = ws.inputs, mode = "clip" )
+				ny.take( self.targets, batch, axis = 0, out = ws.targets, mode = "clip" )
+				self._train_step( ws.inputs, ws.targets )
+
 
-			# Compute error and update weights
-			deltao, deltah = self._compute_errors()
-			self._update_weights( deltao, deltah )
+	def train_stream( self, chunks, eta = 0.25, outtype = "logistic" ):
+		""" Train the network with one pass over a stream of data.
+		The weights are updated once per chunk.
 
-			# Randomise order of training data
-			ny.random.shuffle( shuffle )
-			self.inputs = self.inputs[shuffle,:]
-			self.targets = self.targets[shuffle,:]
+		chunks  -- Iterable of dataset.Dataset chunks, e.g. from dataset.stream().
+		eta     -- Learning rate.
+		outtype -- Activation function to use: "linear", "logistic"
+		"""
+
+		self.eta = eta
+		self.outtype = outtype
+		self._inference = None
+		self._init_updates()
+
+		for chunk in chunks:
+			ws = self._workspace( len( chunk ) ).batch()
+			ws.inputs[:,:-1] = chunk.floats()
+			ws.inputs[:,-1] = -1.0 # Bias node
+			ws.targets[:] = chunk.targets()
+			self._train_step( ws.inputs, ws.targets )
+
+
+	def _init_updates( self ):
+		""" Init arrays for weight updates. """
+
+		# Imported weights are read-only memory maps
+		if not self.weights_layer1.flags.writeable:
+			self.weights_layer1 = self.weights_layer1.copy()
+		if not self.weights_layer2.flags.writeable:
+			self.weights_layer2 = self.weights_layer2.copy()
+
+		self.update_w1 = ny.zeros( ny.shape( self.weights_layer1 ), dtype = self.dtype )
+		self.update_w2 = ny.zeros( ny.shape( self.weights_layer2 ), dtype = self.dtype )
+		self._step_w1 = ny.empty( ny.shape( self.weights_layer1 ), dtype = self.dtype )
+		self._step_w2 = ny.empty( ny.shape( self.weights_layer2 ), dtype = self.dtype )
+
+
+	def _workspace( self, n ):
+		""" Returns the work buffers for batches of n samples. """
+
+		if n not in self._workspaces:
+			self._workspaces[n] = Workspace( n, self.nodes_in, self.nodes_hidden, self.nodes_out, self.dtype )
+
+		return self._workspaces[n]
+
+
+	def _train_step( self, inputs, targets ):
+		""" One weight update with the given data.
+
+		inputs  -- Input data with bias node.
+		targets -- Target values to the input data.
+		"""
+
+		outputs = self._forward( inputs )
+
+		# Compute error and update weights
+		deltao, deltah = self._compute_errors( targets, outputs )
+		self._update_weights( inputs, deltao, deltah )
 
 
 	def _forward( self, inputs ):
 		""" Forward phase.
-		Returns the calculated outputs.
+		Returns the calculated outputs. The returned array is a work
+		buffer and will be overwritten by the next call with the same batch size.
 		"""
 
-		ones = -ny.ones( ( len( inputs ), 1 ) )
+		inputs = ny.asarray( inputs, dtype = self.dtype )
+		ws = self._workspace( len( inputs ) )
 
 		# Activation in hidden layer
-		self.hidden = ny.dot( inputs, self.weights_layer1 )
-		self.hidden = 1.0 / ( 1.0 + ny.exp( -self.beta * self.hidden ) )
-		self.hidden = ny.concatenate( ( self.hidden, ones ), axis = 1 )
+		ny.dot( inputs, self.weights_layer1, out = ws.pre )
+		ws.pre *= -self.beta
+		ny.exp( ws.pre, out = ws.pre )
+		ws.pre += 1.0
+		ny.divide( 1.0, ws.pre, out = ws.hidden[:,:-1] )
+		self.hidden = ws.hidden
 
 		# Acitvation in output layer
-		outputs = ny.dot( self.hidden, self.weights_layer2 )
+		ny.dot( ws.hidden, self.weights_layer2, out = ws.outputs )
 
-		if self.outtype == "linear":
-			pass
-		elif self.outtype == "logistic":
-			outputs = 1.0 / ( 1.0 + ny.exp( -self.beta * outputs ) )
-		elif self.outtype == 'softmax':
-			normalizers = ny.sum( ny.exp( outputs ), axis = 1 ) * ny.ones( ( 1, ny.shape( outputs )[0] ) )
-			outputs = ny.transpose( ny.transpose( ny.exp( outputs ) ) / normalizers )
-		else:
-			print "ERROR: Unknown outtype = %s" % outtype
-
-		return outputs
+		return self._activate_output( ws.outputs, self.outtype )
 
 
-	def _compute_errors( self ):
+	def _compute_errors( self, targets, outputs ):
 		""" Compute the error of each layer.
-		Returns the error of the output and hidden layer.
+
+		targets -- Target values.
+		outputs -- Outputs of the forward phase.
+		Returns the error of the output and hidden layer (without the bias node).
 		"""
 
+		ws = self._workspace( len( targets ) ).errors()
+
 		# Error in output layer
-		deltao = ( self.targets - self.outputs )
+		deltao = ny.subtract( targets, outputs, out = ws.deltao )
 
 		if self.outtype == "linear":
-			deltao /= self.data_amount
+			deltao /= len( targets )
 		elif self.outtype == "logistic":
-			deltao *= self.outputs * ( 1.0 - self.outputs )
+			deltao *= outputs
+			ny.subtract( 1.0, outputs, out = ws.scratch )
+			deltao *= ws.scratch
 		elif self.outtype == 'softmax':
-			deltao /= self.data_amount
+			deltao /= len( targets )
 
 		# Error in hidden layer
-		deltah = self.hidden * ( 1.0 - self.hidden )
-		deltah *= ny.dot( deltao, ny.transpose( self.weights_layer2 ) )
+		hidden = self.hidden[:,:-1]
+		deltah = ny.subtract( 1.0, hidden, out = ws.deltah )
+		deltah *= hidden
+		ny.dot( deltao, ny.transpose( self.weights_layer2[:-1] ), out = ws.back )
+		deltah *= ws.back
 
 		return deltao, deltah
 
 
-	def _update_weights( self, deltao, deltah ):
+	def _update_weights( self, inputs, deltao, deltah ):
 		""" Update weights of layers.
 
+		inputs -- Input data with bias node.
 		deltao -- Error in output layer.
-		deltah -- Error in hidden layer.
+		deltah -- Error in hidden layer (without the bias node).
 		"""
 
-		inputs_tr = ny.transpose( self.inputs )
-		hidden_tr = ny.transpose( self.hidden )
+		self.update_w1 *= self.momentum
+		ny.dot( ny.transpose( inputs ), deltah, out = self._step_w1 )
+		self._step_w1 *= self.eta
+		self.update_w1 += self._step_w1
 
-		self.update_w1 = self.momentum * self.update_w1
-		self.update_w1 += self.eta * ny.dot( inputs_tr, deltah[:,:-1] )
-
-		self.update_w2 = self.momentum * self.update_w2
-		self.update_w2 += self.eta * ny.dot( hidden_tr, deltao )
+		self.update_w2 *= self.momentum
+		ny.dot( ny.transpose( self.hidden ), deltao, out = self._step_w2 )
+		self._step_w2 *= self.eta
+		self.update_w2 += self._step_w2
 
 		self.weights_layer1 += self.update_w1
 		self.weights_layer2 += self.update_w2
 
 
+	def _activate_output( self, outputs, outtype ):
+		""" Apply the activation function of the output layer in place.
+
+		outputs -- Weighted sums of the output layer, one row per sample.
+		outtype -- Activation function to use: "linear", "logistic", "softmax"
+		"""
+
+		if outtype == "linear":
+			pass
+		elif outtype == "logistic":
+			outputs *= -self.beta
+			ny.exp( outputs, out = outputs )
+			outputs += 1.0
+			ny.reciprocal( outputs, out = outputs )
+		elif outtype == "softmax":
+			outputs -= outputs.max( axis = 1 ).reshape( -1, 1 )
+			ny.exp( outputs, out = outputs )
+			outputs /= outputs.sum( axis = 1 ).reshape( -1, 1 )
+		else:
+			print "ERROR: Unknown outtype = %s" % outtype
+
+		return outputs
+
+
+	def _prepare_inference( self ):
+		""" Prepare the weight layers for predict_batch().
+		The bias nodes are folded into separate bias vectors and
+		the factor -beta of the hidden activation is applied in advance.
+		"""
+
+		w1 = -self.beta * self.weights_layer1[:-1]
+		b1 = self.beta * self.weights_layer1[-1]
+		w2 = ny.ascontiguousarray( self.weights_layer2[:-1] )
+		b2 = -self.weights_layer2[-1]
+
+		self._inference = ( w1, b1, w2, b2, {} )
+
+
+	def predict_batch( self, inputs, outtype = None ):
+		""" Use the trained network on many samples at once.
+
+		inputs  -- Matrix with one sample per row.
+		outtype -- Activation function of the output layer. Default: The one used in training.
+		Returns the calculated outputs, one row per sample. The returned array
+		is a work buffer and will be overwritten by the next call with the same batch size.
+		"""
+
+		if self._inference is None:
+			self._prepare_inference()
+		w1, b1, w2, b2, buffers = self._inference
+
+		inputs = ny.asarray( inputs, dtype = w1.dtype )
+		n = len( inputs )
+		if n not in buffers:
+			buffers[n] = (
+				ny.empty( ( n, self.nodes_hidden ), dtype = w1.dtype ),
+				ny.empty( ( n, self.nodes_out ), dtype = w1.dtype )
+			)
+		hidden, outputs = buffers[n]
+
+		# Activation in hidden layer
+		ny.dot( inputs, w1, out = hidden )
+		hidden += b1
+		ny.exp( hidden, out = hidden )
+		hidden += 1.0
+		ny.reciprocal( hidden, out = hidden )
+
+		# Activation in output layer
+		ny.dot( hidden, w2, out = outputs )
+		outputs += b2
+
+		return self._activate_output( outputs, outtype or self.outtype )
+
+
+	def incremental( self, inputs = None ):
+		""" Create an evaluator which updates the hidden layer stone by stone.
+
+		inputs -- Starting position. Default: The empty board.
+		"""
+
+		return IncrementalEvaluator( self, inputs )
+
+
 	def use( self, inputs ):
 		""" After training the network, now use it!
 
-		inputs -- Input/test data.
-		Returns the calculated output.
+		inputs -- Input/test data. Either one sample or a matrix with one sample per row.
+		Returns the calculated output, one row per sample.
 		"""
 
-		inputs = ny.array( [inputs] )
+		inputs = ny.atleast_2d( inputs )
 
 		# Add bias node
-		ones = -ny.ones( ( 1, 1 ) )
+		ones = -ny.ones( ( len( inputs ), 1 ) )
 		inputs = ny.concatenate( ( inputs, ones ), axis = 1 )
 
 		# Activation in hidden layer
@@ -226,23 +511,29 @@ class MLP:
 
 
 	def export( self, filename = MLP_EXPORT_FILE ):
-		""" Export the weight layers of the MLP. """
+		""" Export the weight layers of the MLP in the binary format.
+		The file holds the raw weight layers and the shapes and hyperparameters as meta data.
+		"""
 
-		layer_1, layer_2 = "", ""
+		meta = {
+			"nodes_in": self.nodes_in,
+			"nodes_hidden": self.nodes_hidden,
+			"nodes_out": self.nodes_out,
+			"beta": float( self.beta ),
+			"momentum": float( self.momentum ),
+			"outtype": self.outtype
+		}
+		binfile.write( filename, EXPORT_MAGIC, EXPORT_VERSION, meta, [
+			( "weights_layer1", self.weights_layer1 ),
+			( "weights_layer2", self.weights_layer2 )
+		] )
 
-		for line in self.weights_layer1:
-			for ele in line:
-				layer_1 += str( ele ) + " "
-		layer_1 = layer_1.replace( '[', '' )
-		layer_1 = layer_1.replace( ']', '' )
-		layer_1 = layer_1.replace( '  ', ' ' )
 
-		for line in self.weights_layer2:
-			for ele in line:
-				layer_2 += str( ele ) + " "
-		layer_2 = layer_2.replace( '[', '' )
-		layer_2 = layer_2.replace( ']', '' )
-		layer_2 = layer_2.replace( '  ', ' ' )
+	def export_txt( self, filename = MLP_EXPORT_FILE_TXT ):
+		""" Export the weight layers of the MLP in the text format. """
+
+		layer_1 = "".join( str( ele ) + " " for ele in self.weights_layer1.ravel() )
+		layer_2 = "".join( str( ele ) + " " for ele in self.weights_layer2.ravel() )
 
 		f = open( filename, 'w' )
 		f.write( "# Config:\n" )
@@ -258,87 +549,188 @@ class MLP:
 	def export_js( self, filename = MLP_EXPORT_FILE_JS ):
 		""" Export the weight layers of the MLP as Javascript. """
 
-		layer_1, layer_2 = "", ""
-
-		count = 0
-		for line in self.weights_layer1:
-			for ele in line:
-				count += 1
-				if count == 1:
-					layer_1 += "["
-				if count == self.nodes_hidden:
-					layer_1 += str( ele ) + "],\n"
-					count = 0
-				else:
-					layer_1 += str( ele ) + ", "
-		layer_1 = layer_1[:-2]
-
-		count = 0
-		for line in self.weights_layer2:
-			for ele in line:
-				count += 1
-				if count == 1:
-					layer_2 += "["
-				if count == self.nodes_out:
-					layer_2 += str( ele ) + "],\n"
-					count = 0
-				else:
-					layer_2 += str( ele ) + ", "
-		layer_2 = layer_2[:-2]
-
 		f = open( filename, 'w' )
-		layers = [layer_1, layer_2]
+		layers = [self.weights_layer1, self.weights_layer2]
 		for i in range( len( layers ) ):
 			f.write( "var MLP_weights_" + str( i + 1 ) + " = new Array(\n" )
-			f.write( layers[i] )
+			f.write( ",\n".join( "[" + ", ".join( str( ele ) for ele in line ) + "]" for line in layers[i] ) )
 			f.write( ");\n" )
 		f.close()
 
 
 	def import_ai( self, filename = MLP_EXPORT_FILE ):
-		""" Imports weight layers from a file. """
+		""" Imports weight layers from a file.
+		Binary files are memory-mapped read-only, so several processes can share
+		one file. Training continues on copies. Files in the text format are parsed.
+		The number of hidden nodes is taken from the file.
+		"""
 
-		f = open( filename, 'r' )
+		if binfile.is_binfile( filename, EXPORT_MAGIC ):
+			version, meta, arrays = binfile.read( filename, EXPORT_MAGIC )
+			if version > EXPORT_VERSION:
+				raise ValueError( "%s has the unknown version %d." % ( filename, version ) )
 
-		values_layer1, values_layer2 = [], []
+			layer1, layer2 = arrays["weights_layer1"], arrays["weights_layer2"]
+			self.beta = meta["beta"]
+			self.momentum = meta["momentum"]
+			self.outtype = str( meta["outtype"] )
+		else:
+			layers = { 1: [], 2: [] }
+			import_layer = 0
+
+			f = open( filename, 'r' )
+			for line in f:
+				line = line.strip()
+				if line == "# Layer 1":
+					import_layer = 1
+				elif line == "# Layer 2":
+					import_layer = 2
+				elif import_layer and line and not line.startswith( '#' ):
+					layers[import_layer].append( ny.fromstring( line, sep = ' ' ) )
+			f.close()
+
+			layer1, layer2 = [ny.concatenate( layers[i] + [ny.empty( 0 )] ) for i in ( 1, 2 )]
+			hidden = len( layer1 ) // ( self.nodes_in + 1 )
+			layer1 = layer1.reshape( -1, max( hidden, 1 ) )
+			layer2 = layer2.reshape( -1, self.nodes_out )
+
+		hidden = layer1.shape[1]
+		if layer1.shape != ( self.nodes_in + 1, hidden ) or layer2.shape != ( hidden + 1, self.nodes_out ):
+			raise ValueError(
+				"%s does not fit a network with %d inputs and %d outputs: layers of %s and %s." % (
+					filename, self.nodes_in, self.nodes_out, layer1.shape, layer2.shape
+				)
+			)
+
+		self.nodes_hidden = hidden
+		self.weights_layer1 = ny.asarray( layer1, dtype = self.dtype )
+		self.weights_layer2 = ny.asarray( layer2, dtype = self.dtype )
+		self._workspaces = {}
+		self._inference = None
+
+
+
+class Workspace:
+	""" Work buffers of the MLP for batches of a fixed size.
+	They are allocated once and updated in place in every iteration.
+	The bias node of the hidden layer is stored permanently in its last column.
+	"""
 
-		import_layer = 0
-		for line in f:
-			line = line.strip()
-			if len( line ) <= 1:
-				continue
-			elif line == "# Layer 1":
-				import_layer = 1
-				continue
-			elif line == "# Layer 2":
-				import_layer = 2
-				continue
-			elif line.startswith( '#' ):
-				continue
+	def __init__( self, n, nodes_in, nodes_hidden, nodes_out, dtype ):
+		""" Constructor.
 
-			for value in line.split( ' ' ):
-				if value == '':
-					continue
-				value = float( value.strip() )
-				if import_layer == 1:
-					values_layer1.append( value )
-				elif import_layer == 2:
-					values_layer2.append( value )
-
-		i, j = 0, 0
-		for v in values_layer1:
-			if j >= self.nodes_hidden:
-				j = 0
-				i += 1
-			self.weights_layer1[i][j] = v
-			j += 1
-
-		i = 0
-		for v in values_layer2:
-			self.weights_layer2[i][0] = v
-			i += 1
+		n            -- Number of samples per batch.
+		nodes_in     -- Number of input nodes (without bias node).
+		nodes_hidden -- Number of hidden nodes.
+		nodes_out    -- Number of output nodes.
+		dtype        -- Floating point type of the buffers.
+		"""
+
+		self.shape = ( n, nodes_in, nodes_hidden, nodes_out )
+		self.dtype = dtype
+
+		# Forward phase
+		self.pre = ny.empty( ( n, nodes_hidden ), dtype = dtype )
+		self.hidden = ny.empty( ( n, nodes_hidden + 1 ), dtype = dtype )
+		self.hidden[:,-1] = -1.0
+		self.outputs = ny.empty( ( n, nodes_out ), dtype = dtype )
+
+		# Only needed in training, allocated on first use
+		self.deltao = None
+		self.inputs = None
 
-		f.close()
+
+	def errors( self ):
+		""" Allocate the buffers for the errors of each layer. Returns self. """
+
+		if self.deltao is None:
+			n, nodes_in, nodes_hidden, nodes_out = self.shape
+			self.deltao = ny.empty( ( n, nodes_out ), dtype = self.dtype )
+			self.scratch = ny.empty( ( n, nodes_out ), dtype = self.dtype )
+			self.deltah = ny.empty( ( n, nodes_hidden ), dtype = self.dtype )
+			self.back = ny.empty( ( n, nodes_hidden ), dtype = self.dtype )
+
+		return self
+
+
+	def batch( self ):
+		""" Allocate the buffers for the inputs (with bias node) and targets of a batch. Returns self. """
+
+		if self.inputs is None:
+			n, nodes_in, nodes_hidden, nodes_out = self.shape
+			self.inputs = ny.empty( ( n, nodes_in + 1 ), dtype = self.dtype )
+			self.targets = ny.empty( ( n, nodes_out ), dtype = self.dtype )
+
+		return self
+
+
+
+class IncrementalEvaluator:
+	""" Incremental forward pass of a trained MLP.
+	Keeps the weighted sums of the hidden layer for the current position. Placing or
+	removing a stone only changes one input, so the sums are updated with one row of
+	the first weight layer in O(hidden nodes) instead of the full product.
+	"""
+
+	def __init__( self, net, inputs = None ):
+		""" Constructor.
+
+		net    -- Trained MLP.
+		inputs -- Starting position. Default: All inputs 0 (the empty board).
+		"""
+
+		if net._inference is None:
+			net._prepare_inference()
+		self.net = net
+		self.w1, b1, self.w2, self.b2, _ = net._inference
+
+		self.hidden = b1.copy()
+		if inputs is not None:
+			self.hidden += ny.dot( ny.asarray( inputs, dtype = self.w1.dtype ), self.w1 )
+
+
+	def place( self, index, value ):
+		""" Set the (previously 0) input at the given index to value. """
+
+		self.hidden += value * self.w1[index]
+
+
+	def remove( self, index, value ):
+		""" Reset the input at the given index from value back to 0. """
+
+		self.hidden -= value * self.w1[index]
+
+
+	def score( self, indices, value, outtype = None ):
+		""" Evaluate the children of the current position.
+
+		indices -- Index of the changed input for every child.
+		value   -- Value the input is set to.
+		outtype -- Activation function of the output layer. Default: The one used in training.
+		Returns the calculated outputs, one row per child.
+		"""
+
+		hidden = self.w1[indices]
+		hidden *= value
+		hidden += self.hidden
+		ny.exp( hidden, out = hidden )
+		hidden += 1.0
+		ny.reciprocal( hidden, out = hidden )
+
+		outputs = ny.dot( hidden, self.w2 )
+		outputs += self.b2
+
+		return self.net._activate_output( outputs, outtype or self.net.outtype )
+
+
+
+def convert( file_in = MLP_EXPORT_FILE_TXT, file_out = MLP_EXPORT_FILE,
+		nodes_in = DATA_NUM_ATTR - 1, nodes_out = 1 ):
+	""" Convert weight layers exported in the text format into the binary format. """
+
+	net = MLP( ny.zeros( ( 1, nodes_in ) ), ny.zeros( ( 1, nodes_out ) ) )
+	net.import_ai( file_in )
+	net.export( file_out )
 
 
 
@@ -361,7 +753,7 @@ if __name__ == "__main__":
 		else: print "  False: %d == %d" % ( out[i], target[i] )
 	print "Correct: %d/4" % correct
 
-	export_file = "exports/export_mlp_xor.txt"
+	export_file = "exports/export_mlp_xor.bin"
 	my_mlp.export( export_file )
 	print "Weight layers exported to %s." % export_file
 	my_mlp.import_ai( export_file )
@@ -378,4 +770,18 @@ if __name__ == "__main__":
 	for i in range( 4 ):
 		if out[i] == target[i]: correct += 1
 		else: print "  False: %d == %d" % ( out[i], target[i] )
-	print "Correct: %d/4" % correct
\ No newline at end of file
+	print "Correct: %d/4" % correct
+
+	print
+	print "Testing float32 against float64 with random boards:"
+	ny.random.seed( 2 )
+	boards = ny.random.randint( -1, 2, ( 2000, 42 ) )
+	labels = ( ny.dot( boards, ny.random.randn( 42 ) ) > 0 ).reshape( -1, 1 )
+	accuracy = {}
+	for dtype in ( "float64", "float32" ):
+		ny.random.seed( 3 )
+		my_mlp = MLP( boards, labels, hidden_nodes = 10, dtype = dtype )
+		my_mlp.train( eta = 0.35, iterations = 300, outtype = "linear" )
+		accuracy[dtype] = ny.mean( ( my_mlp.predict_batch( boards ) > 0.5 ) == labels )
+		print "  Accuracy %s: %f" % ( dtype, accuracy[dtype] )
+	print "Difference: %f" % abs( accuracy["float64"] - accuracy["float32"] )
@@ -11,14 +11,17 @@ class Perceptron:
 	(http://seat.massey.ac.nz/personal/s.r.marsland/MLBook.html)
 	"""
 
-	def __init__( self, inputs, targets ):
-		""" Constructor. """
+	def __init__( self, inputs, targets, dtype = DTYPE ):
+		""" Constructor.
+
+		dtype -- Floating point type of the weights.
+		"""
 
 		self.nodes_in = len( inputs[0] )
 		self.nodes_out = len( targets[0] )
 		self.data_amount = len( inputs )
 
-		self.weights = ny.random.rand( self.nodes_in + 1, self.nodes_out ) * 0.1 - 0.05
+		self.weights = ( ny.random.rand( self.nodes_in + 1, self.nodes_out ) * 0.1 - 0.05 ).astype( dtype )
 
 
 	def train( self, inputs, targets, eta, iterations ):
@@ -29,7 +32,7 @@ class Perceptron:
 		"""
 
 		# Add bias node
-		ones = -ny.ones( ( self.data_amount, 1 ) )
+		ones = -ny.ones( ( self.data_amount, 1 ), dtype = self.weights.dtype )
 		inputs = ny.concatenate( ( inputs, ones ), axis = 1 )
 
 		change = range( self.data_amount )
@@ -44,6 +47,35 @@ class Perceptron:
 			targets = targets[change,:]
 
 
+	def solve( self, inputs, targets, ridge = 0.0 ):
+		""" Compute the weights in one step with least squares instead of training.
+		Solves the normal equations ( X^T X + ridge * I ) W = X^T T, where X
+		are the inputs with the bias node. The bias weight is not regularised.
+
+		inputs  -- Input data, one sample per row.
+		targets -- Target data to inputs.
+		ridge   -- Regularisation of the weights. 0 for plain least squares.
+		"""
+
+		# Add bias node
+		ones = -ny.ones( ( len( inputs ), 1 ), dtype = self.weights.dtype )
+		inputs = ny.concatenate( ( inputs, ones ), axis = 1 )
+
+		# Accumulate in double precision, the normal equations square the condition number.
+		trans_in = ny.transpose( inputs ).astype( ny.float64 )
+		gram = ny.dot( trans_in, inputs )
+		gram[range( self.nodes_in ), range( self.nodes_in )] += ridge
+		moments = ny.dot( trans_in, targets )
+
+		try:
+			weights = ny.linalg.solve( gram, moments )
+		except ny.linalg.LinAlgError:
+			# Singular without regularisation, e.g. unused RBF nodes
+			weights = ny.linalg.lstsq( gram, moments, rcond = None )[0]
+
+		self.weights[:] = weights
+
+
 	def _forward( self, inputs ):
 		""" Forward the network.
 
@@ -57,15 +89,29 @@ class Perceptron:
 		return ny.where( outputs > 0, 1, 0 )
 
 
+	def activations( self, inputs, out = None ):
+		""" Returns the outputs before the activation function.
+
+		inputs -- Input data with the bias node, one sample per row.
+		out    -- Array to write the outputs into. Default: A new array.
+		"""
+
+		return ny.dot( inputs, self.weights, out = out )
+
+
+	def decide( self, outputs ):
+		""" Classify outputs of activations(). An output node is 1 if its
+		output is at least half of the highest output of the sample, otherwise 0.
+		"""
+
+		return ny.where( outputs / outputs.max( axis = 1 ).reshape( -1, 1 ) < 0.5, 0, 1 )
+
+
 	def use( self, inputs ):
 		""" Use the trained network. Which means running it forward.
 
-		inputs -- Input data to use the trained perceptron on.
-		Returns the classification by the perceptron. Which is either 1 or 0.
+		inputs -- Input data to use the trained perceptron on, one sample per row.
+		Returns the classification by the perceptron for every sample. Which is either 1 or 0.
 		"""
 
-		outputs = ny.dot( inputs, self.weights )[0]
-		outputs /= max( outputs )
-		outputs = ny.where( outputs < 0.5, 0, 1 )
-
-		return outputs
\ No newline at end of file
+		return self.decide( self.activations( inputs ) )
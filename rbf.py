@@ -2,8 +2,13 @@
 # -*- coding: utf-8 -*-
 
 from global_vars import *
-import numpy as ny
-import pcn, kmeans
+import threading, numpy as ny
+import pcn, kmeans, binfile
+
+
+# Binary export format
+EXPORT_MAGIC = "C4RBF\0\0\0"
+EXPORT_VERSION = 1
 
 
 class RBF:
@@ -13,7 +18,8 @@ class RBF:
 	"""
 
 	def __init__( self, inputs, targets, rbfs_amount,
-			sigma = 0, use_kmeans = False, normalize = False ):
+			sigma = 0, use_kmeans = False, normalize = False, solver = "perceptron", ridge = 0.0,
+			dtype = DTYPE ):
 		""" Constructor.
 
 		inputs      -- Input data for training.
@@ -22,10 +28,14 @@ class RBF:
 		sigma       -- Radius of RBF neuron field. 0 for automatic calculation.
 		use_kmeans  -- Use k-means to initialise weights. Default: False
 		normalize   -- Default: False
+		solver      -- Fitting of the output layer: "perceptron" (trained) or "lstsq" (least squares).
+		ridge       -- Regularisation for the "lstsq" solver. Default: 0.0
+		dtype       -- Floating point type of data and weights.
 		"""
 
-		self.inputs = ny.array( inputs )
-		self.targets = ny.array( targets )
+		self.dtype = ny.dtype( dtype )
+		self.inputs = ny.array( inputs, dtype = self.dtype )
+		self.targets = ny.array( targets, dtype = self.dtype )
 		self.rbfs_amount = rbfs_amount
 
 		self.nodes_in = len( self.inputs[0] )
@@ -34,11 +44,13 @@ class RBF:
 
 		self.use_kmeans = use_kmeans
 		self.normalize = normalize
+		self.solver = solver
+		self.ridge = ridge
 
 		if self.use_kmeans:
 			self.kmeans_net = kmeans.kmeans( self.rbfs_amount )
 
-		self.hidden = ny.zeros( ( self.data_amount, self.rbfs_amount + 1 ) )
+		self.hidden = ny.zeros( ( self.data_amount, self.rbfs_amount + 1 ), dtype = self.dtype )
 
 		if sigma == 0:
 			d = ( self.inputs.max( axis = 0 ) - self.inputs.min( axis = 0 ) ).max()
@@ -46,51 +58,89 @@ class RBF:
 		else:
 			self.sigma = sigma
 
-		self.perceptron = pcn.Perceptron( self.hidden[:,:-1], self.targets )
+		self.perceptron = pcn.Perceptron( self.hidden[:,:-1], self.targets, self.dtype )
 
-		self.weights = ny.zeros( ( self.nodes_in, self.rbfs_amount ) )
+		self.weights = ny.zeros( ( self.nodes_in, self.rbfs_amount ), dtype = self.dtype )
 
+		# Work buffers of predict_batch(), separate for every thread
+		self._local = threading.local()
 
-	def train( self, eta = 0.25, iterations = 100 ):
+
+	def train( self, eta = 0.25, iterations = 100, kmeans_init = "k-means++", kmeans_n_init = 1,
+			kmeans_batch = 0, kmeans_iter = 10 ):
 		""" Train the network.
 
-		eta        -- Learning rate.
-		iterations -- Number of rounds to the train the perceptron.
+		eta           -- Learning rate. Not used by the "lstsq" solver.
+		iterations    -- Number of rounds to the train the perceptron. Not used by the "lstsq" solver.
+		kmeans_init   -- Seeding of k-means: "k-means++" or "uniform"
+		kmeans_n_init -- Runs of k-means with different seeds. The best result is used.
+		kmeans_batch  -- Rows per mini-batch in k-means. 0 for full batch.
+		kmeans_iter   -- Maximum number of k-means iterations.
 		"""
 
+		# Imported weights are read-only memory maps
+		if not self.weights.flags.writeable:
+			self.weights = self.weights.copy()
+		if not self.perceptron.weights.flags.writeable:
+			self.perceptron.weights = self.perceptron.weights.copy()
+
 		if self.use_kmeans == False:
 			indices = range( self.data_amount )
 			ny.random.shuffle( indices )
 			for i in range( self.rbfs_amount ):
 				self.weights[:,i] = self.inputs[indices[i],:]
 		else:
-			self.weights = ny.transpose( self.kmeans_net.train( self.inputs ) )
+			self.kmeans_net.init = kmeans_init
+			self.kmeans_net.n_init = kmeans_n_init
+			self.kmeans_net.batch_size = kmeans_batch
+			self.weights = ny.transpose( self.kmeans_net.train( self.inputs, kmeans_iter ) )
 
 		print "- Trained RBF nodes."
 
 		self.hidden = self._hidden_nodes_activation( self.inputs, self.hidden )
-		self.perceptron.train( self.hidden[:,:-1], self.targets, eta, iterations )
+		if self.solver == "lstsq":
+			self.perceptron.solve( self.hidden[:,:-1], self.targets, self.ridge )
+		else:
+			self.perceptron.train( self.hidden[:,:-1], self.targets, eta, iterations )
 
 		print "- Trained perceptron."
 
 
-	def _hidden_nodes_activation( self, inputs, hidden ):
+	def _hidden_nodes_activation( self, inputs, hidden, dist = None ):
 		""" Use input data on the RBFs with the activation function.
+		The squared distances to all centres are calculated with one matrix product
+		per chunk of rows: |x - c|^2 = |x|^2 - 2 x.c + |c|^2
 
 		inputs -- Input data to use on the activation function.
-		hidden -- Hidden layer of nodes.
+		hidden -- Hidden layer of nodes. The activations are written into all but the last column.
+		dist   -- Work buffer for the distances of one chunk of rows. Default: Allocated for this call.
 		"""
 
-		ones_input = ny.ones( ( 1, self.nodes_in ) )
+		inputs = ny.asarray( inputs, dtype = self.dtype )
+		centres_square = ( self.weights ** 2 ).sum( axis = 0 )
 		sigma_square = 2 * self.sigma ** 2
 
-		for i in range( self.rbfs_amount ):
-			tmp = inputs - ones_input * self.weights[:,i]
-			hidden[:,i] = ny.exp( -ny.sum( tmp ** 2, axis = 1 ) / sigma_square )
+		chunk_size = max( min( RBF_CHUNK_SIZE, len( inputs ) ), 1 )
+		if dist is None:
+			dist = ny.empty( ( chunk_size, self.rbfs_amount ), dtype = self.dtype )
+
+		for start in range( 0, len( inputs ), chunk_size ):
+			chunk = inputs[start:start + chunk_size]
+			act = dist[:len( chunk )]
+
+			ny.dot( chunk, self.weights, out = act )
+			act *= -2.0
+			act += centres_square
+			act += ( chunk ** 2 ).sum( axis = 1 ).reshape( -1, 1 )
+			# Rounding errors may lead to small negative distances
+			ny.maximum( act, 0.0, out = act )
+			act /= -sigma_square
+			ny.exp( act, out = act )
 
-		if self.normalize:
-			ones_hidden = ny.ones( ( 1, len( hidden ) ) )
-			hidden[:,:-1] /= ny.transpose( ones_hidden * hidden[:,:-1].sum( axis = 1 ) )
+			if self.normalize:
+				act /= act.sum( axis = 1 ).reshape( -1, 1 )
+
+			hidden[start:start + len( chunk ), :-1] = act
 
 		return hidden
 
@@ -98,11 +148,13 @@ class RBF:
 	def _forward( self, inputs, mode = "pcn_use" ):
 		""" Forward the network.
 
-		inputs -- Input data to forward through the network.
+		inputs -- Input data to forward through the network, one sample per row.
 		"""
 
+		inputs = ny.atleast_2d( inputs )
+
 		# Throw input data on the RBF
-		hidden = ny.zeros( ( len( inputs ), self.rbfs_amount + 1 ) )
+		hidden = ny.zeros( ( len( inputs ), self.rbfs_amount + 1 ), dtype = self.dtype )
 		hidden = self._hidden_nodes_activation( inputs, hidden )
 		# Bias node
 		hidden[:,-1] = -1
@@ -118,31 +170,80 @@ class RBF:
 	def use( self, inputs, mode = "pcn_use" ):
 		""" After training the network, now use it!
 
-		inputs -- Input/test data.
-		Returns the calculated output.
+		inputs -- Input/test data. Either one sample or a matrix with one sample per row.
+		Returns the calculated output, one row per sample.
 		"""
 
 		return self._forward( inputs, mode )
 
 
+	def predict_batch( self, inputs ):
+		""" Use the trained network on many samples at once.
+		Every thread has its own work buffers, so several threads
+		can use the same trained network at the same time.
+
+		inputs -- Matrix with one sample per row.
+		Returns a tuple in the form: ( decisions, activations ). The decisions are
+		1 or 0 for every output node, the activations are the outputs of the perceptron
+		before classification. The activations are a work buffer of the calling thread
+		and will be overwritten by its next call with the same batch size.
+		"""
+
+		inputs = ny.asarray( inputs, dtype = self.dtype )
+		hidden, dist, outputs = self._buffers( len( inputs ) )
+
+		self._hidden_nodes_activation( inputs, hidden, dist )
+		self.perceptron.activations( hidden, outputs )
+
+		return self.perceptron.decide( outputs ), outputs
+
+
+	def _buffers( self, n ):
+		""" Returns the work buffers of the calling thread for a batch of n samples. """
+
+		buffers = getattr( self._local, "buffers", None )
+		if buffers is None:
+			buffers = self._local.buffers = {}
+
+		if n not in buffers:
+			hidden = ny.empty( ( n, self.rbfs_amount + 1 ), dtype = self.dtype )
+			# Bias node
+			hidden[:,-1] = -1
+			buffers[n] = (
+				hidden,
+				ny.empty( ( max( min( RBF_CHUNK_SIZE, n ), 1 ), self.rbfs_amount ), dtype = self.dtype ),
+				ny.empty( ( n, self.nodes_out ), dtype = self.dtype )
+			)
+
+		return buffers[n]
+
+
 	def export( self, filename = RBF_EXPORT_FILE ):
-		""" Export the weight layers of the RBF. """
+		""" Export the weight layers of the RBF in the binary format.
+		The file holds the raw weight layers and the shapes and hyperparameters as meta data.
+		"""
+
+		meta = {
+			"nodes_in": self.nodes_in,
+			"rbfs_amount": self.rbfs_amount,
+			"nodes_out": self.nodes_out,
+			"sigma": float( self.sigma ),
+			"normalize": bool( self.normalize ),
+			"use_kmeans": bool( self.use_kmeans ),
+			"solver": self.solver,
+			"ridge": float( self.ridge )
+		}
+		binfile.write( filename, EXPORT_MAGIC, EXPORT_VERSION, meta, [
+			( "weights", self.weights ),
+			( "perceptron", self.perceptron.weights )
+		] )
 
-		layer_1, layer_2 = "", ""
 
-		for line in self.weights:
-			for ele in line:
-				layer_1 += str( ele ) + " "
-		layer_1 = layer_1.replace( '[', '' )
-		layer_1 = layer_1.replace( ']', '' )
-		layer_1 = layer_1.replace( '  ', ' ' )
+	def export_txt( self, filename = RBF_EXPORT_FILE_TXT ):
+		""" Export the weight layers of the RBF in the text format. """
 
-		for line in self.perceptron.weights:
-			for ele in line:
-				layer_2 += str( ele ) + " "
-		layer_2 = layer_2.replace( '[', '' )
-		layer_2 = layer_2.replace( ']', '' )
-		layer_2 = layer_2.replace( '  ', ' ' )
+		layer_1 = "".join( str( ele ) + " " for ele in self.weights.ravel() )
+		layer_2 = "".join( str( ele ) + " " for ele in self.perceptron.weights.ravel() )
 
 		f = open( filename, 'w' )
 		f.write( "# Config:\n" )
@@ -163,39 +264,11 @@ class RBF:
 	def export_js( self, filename = RBF_EXPORT_FILE_JS ):
 		""" Export the weight layers of the RBF as Javascript. """
 
-		layer_1, layer_2 = "", ""
-
-		count = 0
-		for line in self.weights:
-			for ele in line:
-				count += 1
-				if count == 1:
-					layer_1 += "["
-				if count == self.rbfs_amount:
-					layer_1 += str( ele ) + "],\n"
-					count = 0
-				else:
-					layer_1 += str( ele ) + ", "
-		layer_1 = layer_1[:-2]
-
-		count = 0
-		for line in self.perceptron.weights:
-			for ele in line:
-				count += 1
-				if count == 1:
-					layer_2 += "["
-				if count == self.nodes_out:
-					layer_2 += str( ele ) + "],\n"
-					count = 0
-				else:
-					layer_2 += str( ele ) + ", "
-		layer_2 = layer_2[:-2]
-
 		f = open( filename, 'w' )
-		layers = [layer_1, layer_2]
+		layers = [self.weights, self.perceptron.weights]
 		for i in range( len( layers ) ):
 			f.write( "var RBF_weights_" + str( i + 1 ) + " = new Array(\n" )
-			f.write( layers[i] )
+			f.write( ",\n".join( "[" + ", ".join( str( ele ) for ele in line ) + "]" for line in layers[i] ) )
 			f.write( ");\n" )
 
 		f.write( "var RBF_sigma = %f;" % self.sigma )
@@ -204,56 +277,71 @@ class RBF:
 
 
 	def import_ai( self, filename = RBF_EXPORT_FILE ):
-		""" Imports weight layers from a file. """
-
-		f = open( filename, 'r' )
-
-		values_layer1, values_layer2 = [], []
-
-		import_layer = 0
-		for line in f:
-			line = line.strip()
-			if len( line ) <= 1:
-				continue
-			elif line.startswith( "# Sigma: " ):
-				sigma = line.replace( "# Sigma: ", "" )
-				self.sigma = float( sigma )
-				continue
-			elif line == "# RBF":
-				import_layer = 1
-				continue
-			elif line == "# Perceptron":
-				import_layer = 2
-				continue
-			elif line.startswith( '#' ):
-				continue
-
-			for value in line.split( ' ' ):
-				if value == '':
-					continue
-				value = float( value.strip() )
-				if import_layer == 1:
-					values_layer1.append( value )
-				elif import_layer == 2:
-					values_layer2.append( value )
-
-		i, j = 0, 0
-		for v in values_layer1:
-			if j >= self.rbfs_amount:
-				j = 0
-				i += 1
-			self.weights[i][j] = v
-			j += 1
-
-		i, j = 0, 0
-		for v in values_layer2:
-			if j >= self.nodes_out:
-				j = 0
-				i += 1
-			self.perceptron.weights[i][j] = v
-			j += 1
+		""" Imports weight layers from a file.
+		Binary files are memory-mapped read-only, so several processes can share
+		one file. Training continues on copies. Files in the text format are parsed.
+		The number of RBF nodes is taken from the file.
+		"""
 
-		f.close()
+		if binfile.is_binfile( filename, EXPORT_MAGIC ):
+			version, meta, arrays = binfile.read( filename, EXPORT_MAGIC )
+			if version > EXPORT_VERSION:
+				raise ValueError( "%s has the unknown version %d." % ( filename, version ) )
+
+			layer1, layer2 = arrays["weights"], arrays["perceptron"]
+			self.sigma = meta["sigma"]
+			self.normalize = meta["normalize"]
+		else:
+			layers = { 1: [], 2: [] }
+			import_layer = 0
+
+			f = open( filename, 'r' )
+			for line in f:
+				line = line.strip()
+				if line.startswith( "# Sigma: " ):
+					self.sigma = float( line.replace( "# Sigma: ", "" ) )
+				elif "Normalize: " in line:
+					self.normalize = bool( int( line.split( "Normalize: " )[1] ) )
+				elif line == "# RBF":
+					import_layer = 1
+				elif line == "# Perceptron":
+					import_layer = 2
+				elif import_layer and line and not line.startswith( '#' ):
+					layers[import_layer].append( ny.fromstring( line, sep = ' ' ) )
+			f.close()
+
+			layer1, layer2 = [ny.concatenate( layers[i] + [ny.empty( 0 )] ) for i in ( 1, 2 )]
+			layer1 = layer1.reshape( self.nodes_in, -1 )
+			layer2 = layer2.reshape( -1, self.nodes_out )
+
+		rbfs = layer1.shape[1]
+		if layer1.shape != ( self.nodes_in, rbfs ) or layer2.shape != ( rbfs + 1, self.nodes_out ):
+			raise ValueError(
+				"%s does not fit a network with %d inputs and %d outputs: layers of %s and %s." % (
+					filename, self.nodes_in, self.nodes_out, layer1.shape, layer2.shape
+				)
+			)
+
+		if rbfs != self.rbfs_amount:
+			self.rbfs_amount = rbfs
+			self.hidden = ny.zeros( ( self.data_amount, self.rbfs_amount + 1 ), dtype = self.dtype )
+			self.perceptron = pcn.Perceptron( self.hidden[:,:-1], self.targets, self.dtype )
+			if self.use_kmeans:
+				self.kmeans_net.k = self.rbfs_amount
+
+		self.weights = ny.asarray( layer1, dtype = self.dtype )
+		self.perceptron.weights = ny.asarray( layer2, dtype = self.dtype )
+		self._local = threading.local()
+
+
+
+def convert( file_in = RBF_EXPORT_FILE_TXT, file_out = RBF_EXPORT_FILE,
+		nodes_in = DATA_NUM_ATTR - 1, nodes_out = len( OUTCOMES ) ):
+	""" Convert weight layers exported in the text format into the binary format. """
+
+	net = RBF( ny.zeros( ( 1, nodes_in ) ), ny.zeros( ( 1, nodes_out ) ), 1 )
+	net.import_ai( file_in )
+	net.export( file_out )
 
 
 
@@ -282,7 +370,7 @@ if __name__ == "__main__":
 
 	print "Correct: %d/%d" % ( correct, len( out ) )
 
-	export_file = "exports/export_rbf_xor.txt"
+	export_file = "exports/export_rbf_xor.bin"
 	my_rbf.export( export_file )
 	print "Weight layers exported to %s." % export_file
 	my_rbf.import_ai( export_file )
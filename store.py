@@ -0,0 +1,148 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from global_vars import *
+import os, time, json, hashlib
+import global_vars
+
+
+# Settings of each model type in global_vars
+PREFIXES = { "MLP": "MLP_", "RBF": "RBF_", "DTree": "DT_" }
+
+# Settings which do not change the trained model
+RUNTIME_SETTINGS = (
+	"DT_COUNT_LIMIT", "DT_PARALLEL_MIN_SIZE", "DT_WORKERS",
+	"MLP_CHECKPOINT_EVERY", "RBF_CHUNK_SIZE"
+)
+
+
+def params( model_type ):
+	""" Returns the hyperparameters of a model type: All settings in global_vars
+	with the prefix of the type, except file names and runtime settings.
+	"""
+
+	names = [
+		name for name in dir( global_vars )
+		if name.startswith( PREFIXES[model_type] ) and "FILE" not in name and name not in RUNTIME_SETTINGS
+	]
+	values = dict( ( name, getattr( global_vars, name ) ) for name in names )
+	values["DTYPE"] = DTYPE
+	values["DATA_NORMALIZE"] = DATA_NORMALIZE
+
+	return values
+
+
+def key( model_type, params, data_checksum, seed ):
+	""" Returns the key of a trained model: A hash of everything the training depends on.
+
+	model_type    -- Name of the AI type: MLP, RBF, DTree
+	params        -- Dict of the hyperparameters.
+	data_checksum -- Checksum of the training data.
+	seed          -- Seed of the random number generator used for training.
+	"""
+
+	text = json.dumps( [model_type, params, data_checksum, seed], sort_keys = True )
+
+	return hashlib.sha1( text ).hexdigest()
+
+
+
+class Store:
+	""" Store of trained models, addressed by the key of their training.
+	Every model is an export file with a JSON file describing it. The time of
+	the last use is the modification time of the export. If the store grows
+	larger than its size limit, the least recently used models are removed.
+	"""
+
+	def __init__( self, directory = STORE_DIR, max_size = STORE_MAX_SIZE ):
+		""" Constructor.
+
+		directory -- Directory of the store. Created if missing.
+		max_size  -- Maximum size of all exports in bytes.
+		"""
+
+		self.directory = directory
+		self.max_size = max_size
+
+		if not os.path.isdir( directory ):
+			os.makedirs( directory )
+
+
+	def _path( self, key, ext ):
+		""" Returns the file name of a model or its description. """
+
+		return os.path.join( self.directory, key + ext )
+
+
+	def lookup( self, key ):
+		""" Returns the export file of the model with the given key or None if there is none.
+		The model is marked as used.
+		"""
+
+		filename = self._path( key, ".bin" )
+		if not os.path.exists( filename ) or not os.path.exists( self._path( key, ".json" ) ):
+			return None
+
+		os.utime( filename, None )
+
+		return filename
+
+
+	def add( self, key, ai, info ):
+		""" Export a trained model into the store.
+
+		key  -- Key of the model.
+		ai   -- Trained instance of an AI.
+		info -- Dict describing the model, e.g. type and hyperparameters.
+		"""
+
+		info = dict( info, key = key, created = time.time() )
+
+		ai.export( self._path( key, ".bin" ) )
+		f = open( self._path( key, ".json" ), "w" )
+		json.dump( info, f, sort_keys = True )
+		f.close()
+
+		self.evict( keep = key )
+
+
+	def entries( self ):
+		""" Returns the description of every model, the most recently used one first.
+		The size of the export and the time of the last use are added.
+		"""
+
+		entries = []
+		for name in os.listdir( self.directory ):
+			key, ext = os.path.splitext( name )
+			filename = self._path( key, ".bin" )
+			if ext != ".json" or not os.path.exists( filename ):
+				continue
+
+			f = open( os.path.join( self.directory, name ), "r" )
+			info = json.load( f )
+			f.close()
+			info["size"] = os.path.getsize( filename )
+			info["used"] = os.path.getmtime( filename )
+			entries.append( info )
+
+		entries.sort( key = lambda info: info["used"], reverse = True )
+
+		return entries
+
+
+	def evict( self, keep = None ):
+		""" Remove the least recently used models until the store is not larger than max_size.
+
+		keep -- Key of a model to keep in any case.
+		"""
+
+		entries = self.entries()
+		size = sum( info["size"] for info in entries )
+
+		while size > self.max_size and entries:
+			info = entries.pop()
+			if info["key"] == keep:
+				continue
+			os.remove( self._path( info["key"], ".bin" ) )
+			os.remove( self._path( info["key"], ".json" ) )
+			size -= info["size"]
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from global_vars import *
+import os, sys, time, tempfile, itertools, multiprocessing, numpy as ny
+import mlp, rbf, binfile, dataset, store
+
+
+# Temporary file sharing the data with the worker processes
+SHARED_MAGIC = "C4SWEEP\0"
+
+
+def trials( space ):
+	""" Returns every combination of the values in the search space as dict of settings.
+
+	space -- Dict with a list of values for each setting.
+	"""
+
+	names = sorted( space )
+
+	return [dict( zip( names, values ) ) for values in itertools.product( *[space[name] for name in names] )]
+
+
+def run( model_type, data, space = None, valid_fraction = SWEEP_VALID_FRACTION, min_rounds = SWEEP_MIN_ROUNDS,
+		max_rounds = SWEEP_MAX_ROUNDS, reduction = SWEEP_REDUCTION, processes = SWEEP_WORKERS, filename = None ):
+	""" Search the hyperparameters of an AI type with successive halving.
+	All trials are trained for min_rounds, then only the best 1/reduction of them
+	continue with reduction times as many rounds, until max_rounds are reached.
+	The settings of each trial are passed to the AI, the global config stays untouched.
+
+	model_type     -- AI type to search: "MLP" or "RBF"
+	data           -- Dataset to train and validate with.
+	space          -- Dict with a list of values for each setting. Default: SWEEP_SPACES of the type.
+	valid_fraction -- Fraction of the data used for validation only.
+	min_rounds     -- Rounds of training in the first rung.
+	max_rounds     -- Rounds of training in the last rung.
+	reduction      -- Factor of the rounds from one rung to the next, only 1/reduction of the trials are kept.
+	processes      -- Worker processes for the trials. 0 for one per CPU.
+	filename       -- File for the table of results. Default: SWEEP_RESULTS_FILE with the type.
+	Returns the results, the one with the lowest validation error first.
+	"""
+
+	space = space or SWEEP_SPACES[model_type]
+	filename = filename or SWEEP_RESULTS_FILE % model_type.lower()
+
+	results = [
+		{ "settings": settings, "rounds": 0, "seconds": 0.0, "weights": None }
+		for settings in trials( space )
+	]
+
+	order = ny.random.permutation( len( data ) )
+	num_valid = int( len( data ) * valid_fraction )
+
+	handle, shared = tempfile.mkstemp( ".tmp", "sweep-" )
+	os.close( handle )
+
+	try:
+		boards, outcomes = data.categorical()
+		binfile.write( shared, SHARED_MAGIC, 1, {}, [
+			( "boards", boards ), ( "outcomes", outcomes ),
+			( "train", order[num_valid:] ), ( "valid", order[:num_valid] )
+		] )
+		pool = multiprocessing.Pool( processes or None, _init_worker, ( model_type, shared, max_rounds ) )
+
+		try:
+			alive = results
+			rounds = min( min_rounds, max_rounds )
+			while True:
+				tasks = [
+					( r["settings"], r["weights"], r["rounds"], rounds, ny.random.randint( 2 ** 31 - 1 ) )
+					for r in alive
+				]
+				for r, ( weights, error, accuracy, seconds ) in zip( alive, pool.map( _trial_worker, tasks ) ):
+					r.update( weights = weights, error = error, accuracy = accuracy, rounds = rounds )
+					r["seconds"] += seconds
+
+				if VERBOSE:
+					print "[sweep] %d trials with %d rounds, best error: %f" % (
+						len( alive ), rounds, min( r["error"] for r in alive )
+					)
+
+				if rounds >= max_rounds or len( alive ) <= 1:
+					break
+				alive = sorted( alive, key = lambda r: r["error"] )[:max( len( alive ) // reduction, 1 )]
+				rounds = min( rounds * reduction, max_rounds )
+		finally:
+			pool.close()
+			pool.join()
+	finally:
+		os.remove( shared )
+
+	results.sort( key = lambda r: ( -r["rounds"], r["error"] ) )
+	for r in results:
+		del r["weights"]
+	write_table( results, filename )
+
+	return results
+
+
+def write_table( results, filename ):
+	""" Write the results as table with one trial per line, separated by tabs. """
+
+	names = sorted( results[0]["settings"] ) if results else []
+
+	f = open( filename, "w" )
+	f.write( "\t".join( names + ["rounds", "error", "accuracy", "seconds"] ) + "\n" )
+	for r in results:
+		values = [r["settings"][name] for name in names] + [r["rounds"]]
+		f.write( "\t".join( [str( v ) for v in values] ) )
+		f.write( "\t%f\t%f\t%.1f\n" % ( r["error"], r["accuracy"], r["seconds"] ) )
+	f.close()
+
+
+
+# Data of the worker processes running the trials
+_worker = {}
+
+
+def _init_worker( model_type, filename, max_rounds ):
+	""" Initialise a worker process with the memory-mapped data. """
+
+	version, meta, arrays = binfile.read( filename, SHARED_MAGIC )
+	data = dataset.Dataset( arrays["boards"], arrays["outcomes"] )
+
+	_worker["model_type"] = model_type
+	_worker["train"] = data.take( arrays["train"] )
+	_worker["valid"] = data.take( arrays["valid"] )
+	_worker["max_rounds"] = max_rounds
+
+
+def _trial_worker( task ):
+	""" Train one trial up to the given number of rounds in a worker process.
+
+	task -- Tuple in the form: ( settings, weights, rounds done, rounds, seed ).
+	Returns a tuple in the form: ( weights to continue with, validation error, accuracy, seconds ).
+	"""
+
+	settings, weights, done, rounds, seed = task
+	train, valid = _worker["train"], _worker["valid"]
+
+	# Settings of the trial on top of the global config
+	config = store.params( _worker["model_type"] )
+	config.update( settings )
+
+	ny.random.seed( seed )
+	start = time.time()
+
+	if _worker["model_type"] == "MLP":
+		# A round is one call of train() like in early stopping. The MLP continues where it stopped.
+		net = mlp.MLP(
+			train.floats(), train.targets(),
+			hidden_nodes = config["MLP_HIDDEN_NODES"], beta = config["MLP_BETA"], momentum = config["MLP_MOMENTUM"]
+		)
+		if weights is not None:
+			net.weights_layer1, net.weights_layer2 = weights
+		for i in range( rounds - done ):
+			net.train(
+				eta = config["MLP_ETA"], iterations = config["MLP_ITER"], outtype = config["MLP_OUTTYPE"],
+				batch_size = config["MLP_BATCH_SIZE"]
+			)
+
+		outputs = net.predict_batch( valid.floats() )
+		error = ny.mean( ( outputs - valid.targets() ) ** 2 )
+		decisions = ny.abs( outputs - ny.array( OUTCOME_TARGETS, dtype = DTYPE ) ).argmin( axis = 1 )
+		weights = ( net.weights_layer1, net.weights_layer2 )
+	else:
+		# The RBF is trained from scratch on a share of the training data growing with the rounds.
+		part = train.take( slice( 0, max( len( train ) * rounds // _worker["max_rounds"], 1 ) ) )
+		net = rbf.RBF(
+			part.floats(), part.one_hot(),
+			rbfs_amount = config["RBF_NODES"], sigma = config["RBF_SIGMA"], use_kmeans = config["RBF_KMEANS"],
+			normalize = config["RBF_NORMALIZE"], solver = config["RBF_SOLVER"], ridge = config["RBF_RIDGE"]
+		)
+		# The worker process can not start the processes for several runs of k-means.
+		net.train(
+			eta = config["RBF_ETA"], iterations = config["RBF_ITER"],
+			kmeans_init = config["RBF_KMEANS_INIT"], kmeans_n_init = 1,
+			kmeans_batch = config["RBF_KMEANS_BATCH"], kmeans_iter = config["RBF_KMEANS_ITER"]
+		)
+
+		# The activations of a trained perceptron are not bounded, the error is the one of its decisions.
+		outputs, activations = net.predict_batch( valid.floats() )
+		error = ny.mean( ( outputs - valid.one_hot() ) ** 2 )
+		decisions = activations.argmax( axis = 1 )
+		weights = None
+
+	accuracy = ny.mean( decisions == valid.outcomes )
+
+	return weights, float( error ), float( accuracy ), time.time() - start
+
+
+
+if __name__ == "__main__":
+	# Usage: sweep.py MLP|RBF
+	model_type = sys.argv[1] if len( sys.argv ) > 1 else "MLP"
+
+	data = dataset.load( FILE_DATA )
+	ny.random.seed( SEED )
+	data = data.take( ny.random.permutation( len( data ) )[:DATA_LIMIT] )
+
+	results = run( model_type, data )
+	print "Best settings: %s" % results[0]["settings"]
+	print "Results written to %s." % ( SWEEP_RESULTS_FILE % model_type.lower() )